@@ -0,0 +1,123 @@
+"""
+===============================================================================
+Checkpoints of a render
+
+The final states and status of the photons, the mask of the pixels already
+traced and the configuration of the run are saved periodically to a .npz
+file, so an interrupted render can be resumed tracing only the missing
+pixels.
+===============================================================================
+"""
+
+import json
+import os
+from tempfile import mkstemp
+from threading import Thread
+from time import time
+from numpy import savez, load, array
+
+
+def run_config(blackhole, detector, acc_structure, method, r_start=None):
+    '''
+    Parameters that determine the result of a render, used to check that a
+    checkpoint belongs to the same run
+    '''
+    return {'M': float(blackhole.M),
+            'D': float(detector.D),
+            'iota': float(detector.iota),
+            's_side': float(detector.s_side),
+            'n_pixels': int(detector.numPixels),
+            'in_edge': float(acc_structure.in_edge),
+            'out_edge': float(acc_structure.out_edge),
+            'method': method,
+            'r_start': None if r_start is None else float(r_start)}
+
+
+class Checkpoint:
+    '''
+    ===========================================================================
+    Periodic checkpoints of a render in the file filename (.npz)
+    ===========================================================================
+    config : dictionary with the configuration of the run (see run_config)
+    interval : minimum time in seconds between two checkpoints
+    ===========================================================================
+    The arrays are copied in the render loop and written in a background
+    thread to a temporary file, which then replaces filename, so a crash
+    during the write never leaves a corrupted checkpoint. If the previous
+    write has not finished, the new checkpoint is skipped instead of
+    blocking the render.
+    '''
+    def __init__(self, filename, config, interval=60.):
+        self.filename = filename
+        self.config = config
+        self.interval = interval
+        self.last = time()
+        self.thread = None
+
+    def save(self, photons, done, force=False):
+        '''
+        Saves photons.fP, photons.status and the mask done (N,) if
+        interval seconds have passed since the last checkpoint (or always,
+        if force is True, waiting for the previous write to finish)
+        '''
+        if force:
+            self.wait()
+        elif time() - self.last < self.interval or \
+                (self.thread is not None and self.thread.is_alive()):
+            return
+        self.last = time()
+        arrays = {'fP': photons.fP.copy(), 'status': photons.status.copy(),
+                  'done': done.copy(),
+                  'config': array(json.dumps(self.config, sort_keys=True))}
+        self.thread = Thread(target=self.write, args=(arrays,), daemon=True)
+        self.thread.start()
+
+    def write(self, arrays):
+        '''
+        Writes the arrays to a unique temporary file in the directory of 
+        filename and moves it to filename
+        '''
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                savez(f, **arrays)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def wait(self):
+        '''
+        Waits for the checkpoint being written, if any
+        '''
+        if self.thread is not None:
+            self.thread.join()
+
+
+def load_checkpoint(filename, config=None):
+    '''
+    Reads a checkpoint written by Checkpoint.
+    If config is given, it must coincide with the configuration stored in
+    the checkpoint.
+    Returns the arrays fP, status and done.
+    '''
+    with load(filename) as data:
+        stored = json.loads(str(data['config']))
+        if config is not None and stored != json.loads(json.dumps(config)):
+            raise ValueError('The checkpoint %s was written with a different '
+                             'configuration: %s' % (filename, stored))
+        return data['fP'], data['status'], data['done']
+
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
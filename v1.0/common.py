@@ -5,10 +5,27 @@ Common functions for ray tracing in a curved spacetime
 @author: Eduard Larrañga - 2023
 ===============================================================================
 """
-from scipy.integrate import odeint
-from numpy import linspace, cos, zeros
-import matplotlib.pyplot as plt
-import sys
+from numpy import linspace, cos, zeros, array, asarray, isfinite, \
+                  argmax, nonzero, sqrt, exp, int8, int32, meshgrid, arange, \
+                  full, nan, where, allclose, sin, arcsin, arccos, arctan2, \
+                  log, clip, unique, append, concatenate, bincount
+from numpy.lib.format import open_memmap
+from os import getpid
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from lockstep import lockstep_integ, equatorial_crossing, \
+                     INCOMPLETE, CAPTURED, DISK, ESCAPED
+from transfer import TransferTable
+from elliptic import elliptic_trace, elliptic_crossings, classify_photons
+from checkpoint import load_checkpoint
+from hitcache import cache_config
+from progress import Progress
+from writers import save_image
+
+
+# Powers of the mass M in the units of the components of the state of a 
+# photon [t, r, theta, phi, k_t, k_r, k_th, k_phi]
+MASS_DIMENSION = array([1, 1, 0, 0, 0, 0, 1, 1])
 
 
 def initCond(x, k, blackhole):
@@ -28,7 +45,11 @@ def initCond(x, k, blackhole):
     kr = k[1]
     ktheta = k[2]
     kphi = k[3]
+    x and k can also be arrays with shape (4, N) for N photons, and then
+    the initial conditions are returned as an array with shape (8, N)
     '''
+    x, k = asarray(x, dtype=float), asarray(k, dtype=float)
+
     # Metric components
     g_tt, g_rr, g_thth, g_phph = blackhole.metric(x)
     
@@ -38,11 +59,90 @@ def initCond(x, k, blackhole):
     k_th = g_thth*k[2]
     k_phi = g_phph*k[3]
     
-    return [x[0], x[1], x[2], x[3], k_t, k_r, k_th, k_phi]
+    return array([x[0], x[1], x[2], x[3], k_t, k_r, k_th, k_phi])
+
+
+def far_field(iC, blackhole, r_start):
+    '''
+    Moves ingoing photons from their initial radius to r_start analytically,
+    so the numerical integration starts closer to the black hole.
+    ===========================================================================
+    iC : array (N, 8) with the initial conditions of the photons
+    r_start : radius where the integration starts. It must be larger than
+              the outer edge of the accretion structure, so no disk
+              crossing is skipped (see check_r_start)
+    ===========================================================================
+    Each photon keeps its conserved quantities E = -k_t, the total angular
+    momentum L (which fixes the plane of the orbit) and the Hamiltonian H.
+    In that plane, the angle psi swept from the initial position follows
+    from the orbit equation to first order in M,
+        psi(chi) = chi - (M/b)(1/cos(chi) + cos(chi)),   sin(chi) = b/r
+    i.e. a straight line with impact parameter b = L/sqrt(E^2 + 2H) plus the
+    first order deflection, and the coordinate time from
+        t(r) = (E/sqrt(E^2 + 2H))(s + 2M ln(r + s) + M r/s),
+        s = sqrt(r^2 - b^2)
+    k_r is recovered from H. Photons with b > 0.75 r_start (which reach
+    their periastron close to r_start or beyond it), already inside r_start
+    or moving outwards are not modified.
+    Returns a new array (N, 8).
+    '''
+    M = blackhole.M
+    q = array(iC, dtype=float)
+    t, r, th, phi, k_t, k_r, k_th, k_phi = q.T
+    g_tt, g_rr, g_thth, g_phph = blackhole.metric(q[:, :4].T)
+    E = -k_t
+    sin_th, cos_th = sin(th), cos(th)
+    L = sqrt(k_th**2 + (k_phi/sin_th)**2)
+    H = 0.5*(k_t**2/g_tt + k_r**2/g_rr + L**2/g_thth)
+    b = L/sqrt(E**2 + 2.*H)
+    move = (r > r_start) & (k_r > 0.) & (b < 0.75*r_start) & (L > 0.)
+    if not move.any():
+        return q
+    r0, b, L, H, E = r[move], b[move], L[move], H[move], E[move]
+    th, phi, k_th = th[move], phi[move], k_th[move]
+    k_phi, sin_th, cos_th = k_phi[move], sin_th[move], cos_th[move]
+    r1 = float(r_start)
+
+    # Angle swept in the plane of the orbit and coordinate time
+    def psi(r):
+        chi = arcsin(b/r)
+        return chi - (M/b)*(1./cos(chi) + cos(chi))
+
+    def T(r):
+        s = sqrt(r**2 - b**2)
+        return (E*b/L)*(s + 2.*M*log(r + s) + M*r/s)
+
+    dpsi = psi(r1) - psi(r0)
+
+    # Radial and tangent (direction of increasing psi) unit vectors
+    sin_ph, cos_ph = sin(phi), cos(phi)
+    n = array([sin_th*cos_ph, sin_th*sin_ph, cos_th])
+    e_th = array([cos_th*cos_ph, cos_th*sin_ph, -sin_th])
+    e_ph = array([-sin_ph, cos_ph, zeros(len(phi))])
+    e = -(k_th*e_th + (k_phi/sin_th)*e_ph)/L
+    n, e = cos(dpsi)*n + sin(dpsi)*e, -sin(dpsi)*n + cos(dpsi)*e
+
+    th1 = arccos(clip(n[2], -1., 1.))
+    ph1 = arctan2(n[1], n[0])
+    sin_th1 = sin(th1)
+    e_th1 = array([cos(th1)*cos(ph1), cos(th1)*sin(ph1), -sin_th1])
+    e_ph1 = array([-sin(ph1), cos(ph1), zeros(len(ph1))])
+
+    f = 1. - 2.*M/r1
+    q[move, 0] = t[move] + T(r0) - T(r1)
+    q[move, 1] = r1
+    q[move, 2] = th1
+    q[move, 3] = ph1
+    q[move, 5] = sqrt(clip((2.*H + E**2/f - L**2/r1**2)/f, 0., None))
+    q[move, 6] = -L*(e*e_th1).sum(axis=0)
+    q[move, 7] = -L*sin_th1*(e*e_ph1).sum(axis=0)
+    return q
 
 
 
 class Photon:
+    __slots__ = ('alpha', 'beta', 'i', 'j', 'xin', 'kin', 'iC', 'fP')
+
     def __init__(self, alpha, beta, freq=1.):
         '''
         Given the initial coordinates in the image plane (X,Y), the distance D 
@@ -60,6 +160,7 @@ class Photon:
         #Initial position and momentum in spherical coordinates 
         self.xin = None 
         self.kin = None 
+        self.iC = None
         
         # Stores the final values of coordinates and momentum 
         self.fP = None
@@ -72,75 +173,1129 @@ class Photon:
         self.iC = initCond(self.xin, self.kin, blackhole)
 
 
-def geo_integ(p, blackhole, in_edge, out_edge):
+class PhotonBundle:
+    '''
+    Set of N photons stored as contiguous NumPy arrays
+    ===========================================================================
+    alpha, beta : (N,) initial coordinates in the image plane
+    i, j : (N,) pixel coordinates
+    kin : (N, 4) initial contravariant momentum
+    iC : (N, 8) initial conditions [t, r, theta, phi, k_t, k_r, k_th, k_phi]
+    fP : (N, 8) final values of coordinates and momentum
+    status : (N,) final status of the photons (see lockstep.py)
+    The initial position xin is the view iC[:, :4].
+    ===========================================================================
+    '''
+    def __init__(self, N):
+        self.alpha = zeros(N)
+        self.beta = zeros(N)
+        self.i = zeros(N, dtype=int32)
+        self.j = zeros(N, dtype=int32)
+        self.kin = zeros([N, 4])
+        self.iC = zeros([N, 8])
+        self.fP = zeros([N, 8])
+        self.status = zeros(N, dtype=int8)
+
+    @property
+    def xin(self):
+        return self.iC[:, :4]
+
+    def __len__(self):
+        return len(self.iC)
+
+    def __getitem__(self, n):
+        '''
+        Returns the n-th photon as a Photon whose arrays are views of the 
+        rows of the bundle. Assigning a new list to p.fP does not modify 
+        the bundle, use bundle.fP[n] = p.fP to store it.
+        '''
+        p = Photon(alpha=self.alpha[n], beta=self.beta[n])
+        p.i, p.j = int(self.i[n]), int(self.j[n])
+        p.xin, p.kin = self.xin[n], self.kin[n]
+        p.iC, p.fP = self.iC[n], self.fP[n]
+        return p
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+
+def geo_integ(p, blackhole, in_edge, out_edge, n_samples=201):
     '''
     Integrates the motion equations of the photon 
+    The crossings of the equatorial plane are bracketed by the sign changes
+    of r*cos(theta) between consecutive samples and located with 
+    equatorial_crossing, so a coarse grid of n_samples is enough.
+    Returns the final status of the photon (INCOMPLETE, CAPTURED, DISK or 
+    ESCAPED)
+    '''
+    crossings, order, status = geo_crossings(p.iC, blackhole, in_edge, 
+                                             out_edge, 1, n_samples)
+    p.fP = crossings[0] if status == DISK else [0,0,0,0,0,0,0,0]
+    return status
+
+
+def geo_crossings(iC, blackhole, in_edge, out_edge, n_cross, n_samples=201):
+    '''
+    Integrates the motion equations of the photon with initial conditions iC
+    with odeint, recording its first n_cross crossings of the equatorial 
+    plane with in_edge < r < out_edge (see geo_integ).
+    Returns the arrays crossings (n_cross, 8) and order (n_cross,), as in 
+    lockstep_integ, and the final status of the photon (DISK if it was 
+    stopped after n_cross crossings)
     '''
-    lmbda = linspace(0,-200,1500)
-    sol = odeint(blackhole.geodesics, p.iC, lmbda)
-    indx = len(sol[:,1])
+    from scipy.integrate import odeint
+    lmbda = linspace(0,-200,n_samples)
+    sol = odeint(blackhole.geodesics, iC, lmbda)
+    crossings = zeros([n_cross, 8])
+    order = full(n_cross, -1, dtype=int8)
+
+    # Samples before the photon approaches the horizon
+    inside = (sol[:,1] < blackhole.EH + 1e-5) | ~isfinite(sol[:,1])
+    indx = argmax(inside) if inside.any() else len(sol[:,1])
+    z = sol[:indx,1]*cos(sol[:indx,2])
+    count = 0
+    for n, i in enumerate(nonzero(z[:-1]*z[1:] <= 0.)[0]):
+        q = sol[i:i+2]
+        f = blackhole.geodesics_batch(q, axis=1)
+        qc = equatorial_crossing(q[:1], q[1:], f[:1], f[1:], 
+                                 [lmbda[i+1] - lmbda[i]])[0]
+        if qc[1] > in_edge and qc[1] < out_edge:
+            crossings[count], order[count] = qc, n
+            count += 1
+            if count == n_cross:
+                return crossings, order, DISK
+    # As in lockstep_integ, a photon that moves outwards beyond 
+    # max(out_edge, 4M) at the end of the integration has escaped
+    r = sol[:,1]
+    if indx < len(r):
+        status = CAPTURED
+    elif r[-1] > r[-2] and r[-1] > max(out_edge, 4.*blackhole.M):
+        status = ESCAPED
+    else:
+        status = INCOMPLETE
+    return crossings, order, status
+
+
+def geo_integ_events(p, blackhole, in_edge, out_edge, r_escape=None, 
+                     eps=1e-5, lmbda_end=-200., solver='LSODA', rtol=1.49e-8,
+                     atol=1.49e-8):
+    '''
+    Integrates the motion equations of the photon until an event occurs:
+    - the photon approaches the horizon, r = blackhole.EH + eps
+    - the photon crosses the equatorial plane with in_edge < r < out_edge
+    - the photon moves outwards beyond r_escape (by default max(out_edge, 4M))
+    A single solver of scipy.integrate (solver is the name of any of its 
+    OdeSolver classes, e.g. 'LSODA', 'RK45' or 'DOP853') advances the 
+    photon step by step, so the step size is never reset. The crossings of the 
+    equatorial plane are located in the dense output of the step where 
+    r*cos(theta) changes sign, and only a crossing inside the disk stops 
+    the photon. No solution is stored. The default tolerances are those of
+    odeint.
+    Returns the final status of the photon (INCOMPLETE, CAPTURED, DISK or 
+    ESCAPED)
+    '''
+    import scipy.integrate
+    from scipy.optimize import brentq
+    if r_escape is None:
+        r_escape = max(out_edge, 4.*blackhole.M)
+
+    def z(q):
+        return q[1]*cos(q[2])
+
     p.fP = [0,0,0,0,0,0,0,0]
-    for i in range(indx):
-        if sol[i,1] < blackhole.EH + 1e-5: 
-            indx = i
-            break
-        elif abs(sol[i,1]*cos(sol[i,2])) < 1e-1:
-            if sol[i,1] > in_edge and sol[i,1] < out_edge:
-                indx = i
-                p.fP = sol[i]
-                break
+    ode = getattr(scipy.integrate, solver)(
+        lambda lmbda, q: blackhole.geodesics_batch(q, lmbda), 0., p.iC, 
+        lmbda_end, rtol=rtol, atol=atol)
+    q_old = asarray(p.iC, dtype=float)
+    while ode.status == 'running':
+        ode.step()
+        q = ode.y
+        if ode.status == 'failed':
+            return INCOMPLETE
+        if z(q_old)*z(q) <= 0. and z(q_old) != z(q) and isfinite(q[1]):
+            step = ode.dense_output()
+            lmbda = brentq(lambda l: z(step(l)), ode.t_old, ode.t, 
+                           xtol=1e-12)
+            qc = step(lmbda)
+            if qc[1] > in_edge and qc[1] < out_edge:
+                p.fP = qc
+                return DISK
+        if not q[1] > blackhole.EH + eps:
+            return CAPTURED
+        if q[1] > r_escape and q[1] > q_old[1]:
+            return ESCAPED
+        q_old = q
+    return INCOMPLETE
+
+
+def check_method(method, methods):
+    '''
+    Raises a ValueError if method is not one of methods
+    '''
+    if method not in methods:
+        raise ValueError('method must be one of %s, not %r' 
+                         % (', '.join(repr(m) for m in methods), method))
+
+
+def check_r_start(r_start, out_edge):
+    '''
+    Raises a ValueError if r_start is not larger than the outer edge of the
+    accretion structure, since far_field would move the photons past radii
+    where they can hit it
+    '''
+    if r_start is not None and r_start <= out_edge:
+        raise ValueError('r_start = %g must be larger than the outer edge '
+                         '%g of the accretion structure' 
+                         % (r_start, out_edge))
+
+
+def tile_photons(blackhole, detector, rows, cols=None, r_start=None):
+    '''
+    Creates the PhotonBundle with the photons of the detector pixels with 
+    i in range(rows[0], rows[1]) and j in range(cols[0], cols[1]) 
+    (all the columns by default), with their initial conditions. If r_start
+    is given, the photons are moved to that radius with far_field.
+    '''
+    if cols is None:
+        cols = (0, detector.numPixels)
+    alpha, beta = meshgrid(detector.alphaRange[rows[0]:rows[1]], 
+                           detector.betaRange[cols[0]:cols[1]], indexing='ij')
+    i, j = meshgrid(arange(*rows), arange(*cols), indexing='ij')
+    xin, kin = detector.photon_coords_grid(alpha, beta)
+
+    photons = PhotonBundle(alpha.size)
+    photons.alpha[:], photons.beta[:] = alpha.ravel(), beta.ravel()
+    photons.i[:], photons.j[:] = i.ravel(), j.ravel()
+    photons.kin[:] = kin.T
+    photons.iC[:] = initCond(xin, kin, blackhole).T
+    if r_start is not None:
+        photons.iC[:] = far_field(photons.iC, blackhole, r_start)
+    return photons
+
+
+def ray_cost(blackhole, alpha, beta):
+    '''
+    Rough estimate of the relative cost of tracing the photons with screen
+    coordinates (alpha, beta). Photons with an impact parameter below the 
+    critical value 3*sqrt(3)M approach the horizon and photons with 
+    alpha ~ 0 graze the poles, and both need many small steps.
+    '''
+    M = blackhole.M
+    b = sqrt(alpha**2 + beta**2)
+    captured = 1./(1. + exp((b - 3.*sqrt(3.)*M)/(0.25*M)))
+    return 1. + 2.*captured + exp(-(alpha/M)**2)
+
+
+def to_units_of_M(q, M):
+    '''
+    States q (..., 8) [t, r, theta, phi, k_t, k_r, k_th, k_phi] of photons 
+    around a black hole of mass M, in units of M. They are the states of
+    the same photons around a black hole of unit mass.
+    '''
+    return asarray(q)/M**MASS_DIMENSION
+
+
+def from_units_of_M(q, M):
+    '''
+    Inverse of to_units_of_M
+    '''
+    return asarray(q)*M**MASS_DIMENSION
+
+
+def trace(photons, blackhole, acc_structure, method='odeint', index=None):
+    '''
+    Traces the photons of a PhotonBundle (only those in index, if given) 
+    with the given method (see Image.create_image) and stores their final
+    state and status in photons.fP and photons.status.
+    The geodesics are integrated in units of M (see to_units_of_M), so the
+    affine parameter range and the tolerances of the integrators do not 
+    depend on the mass. Only the methods that trace each photon on its own
+    ('odeint', 'events' and 'lockstep') are accepted.
+    '''
+    check_method(method, ('odeint', 'events', 'lockstep'))
+    if index is None:
+        index = range(len(photons))
+    if not len(index):
+        return
+    M = blackhole.M
+    unit = blackhole.unit_mass()
+    in_edge, out_edge = acc_structure.in_edge/M, acc_structure.out_edge/M
+    if method == 'lockstep':
+        index = asarray(index)
+        fP, status = lockstep_integ(to_units_of_M(photons.iC[index], M), 
+                                    unit, in_edge, out_edge)
+        photons.fP[index] = from_units_of_M(fP, M)
+        photons.status[index] = status
+    else:
+        integ = geo_integ_events if method == 'events' else geo_integ
+        for n in index:
+            p = photons[n]
+            p.iC = to_units_of_M(p.iC, M)
+            photons.status[n] = integ(p, unit, in_edge, out_edge)
+            photons.fP[n] = from_units_of_M(p.fP, M)
+
+
+def trace_tile(blackhole, detector, acc_structure, rows, cols=None, 
+               method='odeint', r_start=None, classify=False):
+    '''
+    Creates and traces the photons of a tile of the detector (see 
+    tile_photons). It is the task executed by each process of the pool in
+    Image.create_image, so only the parameters of the black hole, the 
+    detector and the accretion structure are sent to the workers, and only
+    the arrays of results are sent back. If classify is True, only the 
+    photons left unclassified by classify_photons are traced.
+    The 'elliptic' method solves the whole tile at once (see 
+    elliptic_trace), so classify does not apply to it.
+    Returns the pixel indices, final states and status of the photons, and
+    the process id with the start and end times of the task.
+    '''
+    start = time()
+    photons = tile_photons(blackhole, detector, rows, cols, r_start)
+    if method == 'elliptic':
+        photons.fP[:], photons.status[:] = \
+            elliptic_trace(photons, blackhole, detector, 
+                           acc_structure.in_edge, acc_structure.out_edge)[:2]
+        return (photons.i, photons.j, photons.fP, photons.status, 
+                (getpid(), start, time()))
+    index = None
+    if classify:
+        photons.status[:] = classify_photons(photons, blackhole, detector,
+                                             acc_structure.in_edge,
+                                             acc_structure.out_edge)
+        index = nonzero(photons.status == INCOMPLETE)[0]
+    trace(photons, blackhole, acc_structure, method, index)
+    return (photons.i, photons.j, photons.fP, photons.status, 
+            (getpid(), start, time()))
+
+
+def detector_tiles(blackhole, detector, tile_side, n_rows=None):
+    '''
+    Splits the rows i < n_rows (all by default) of the detector in square 
+    tiles of tile_side pixels.
+    Returns a list of tuples (cost, rows, cols), sorted in decreasing order
+    of the estimated cost of the tiles (see ray_cost).
+    '''
+    n = detector.numPixels
+    if n_rows is None:
+        n_rows = n
+    alpha, beta = detector.alphaRange, detector.betaRange
+    tiles = []
+    for i in range(0, n_rows, tile_side):
+        for j in range(0, n, tile_side):
+            rows = (i, min(i + tile_side, n_rows))
+            cols = (j, min(j + tile_side, n))
+            cost = ray_cost(blackhole, alpha[rows[0]:rows[1], None], 
+                            beta[None, cols[0]:cols[1]]).sum()
+            tiles.append((cost, rows, cols))
+    tiles.sort(key=lambda tile: -tile[0])
+    return tiles
+
+
+def record_files(filename):
+    '''
+    Names of the .npy files with the final states and status of the photons
+    that go with the image file filename
+    '''
+    base = filename[:-4] if filename.endswith('.npy') else filename
+    return base + '_fP.npy', base + '_status.npy'
+
+
+def render_tile(blackhole, detector, acc_structure, rows, cols, method, 
+                filename, r_start=None, classify=False, mirror=False, 
+                records=False):
+    '''
+    Traces a tile of the detector (see trace_tile), shades it and writes it 
+    into the memory-mapped image filename (.npy), which must exist. Each 
+    process opens the file and writes only its own tile, so the tiles are 
+    never sent back to the main process.
+    mirror : the tile is also written into the rows i -> n-1-i
+    records : the final states and status of the photons are also written
+              into the files given by record_files(filename)
+    Returns the number of photons of the tile, the number of them with each
+    final status and the process id with the start and end times of the 
+    task.
+    '''
+    start = time()
+    n = detector.numPixels
+    fP, status = trace_tile(blackhole, detector, acc_structure, rows, cols,
+                            method, r_start, classify)[2:4]
+    shape = (rows[1] - rows[0], cols[1] - cols[0])
+    r = where(status == DISK, fP[:, 1], nan).reshape(shape)
+    tile = [(slice(*rows), slice(*cols), 1)]
+    if mirror:
+        tile.append((slice(n - rows[1], n - rows[0]), slice(*cols), -1))
+    image = open_memmap(filename, mode='r+')
+    for i, j, reflection in tile:
+        image[i, j] = acc_structure.spectrum(r)[::reflection]
+    image.flush()
+    if records:
+        fP_file, status_file = record_files(filename)
+        hits = open_memmap(fP_file, mode='r+')
+        codes = open_memmap(status_file, mode='r+')
+        for i, j, reflection in tile:
+            q = fP.reshape(shape + (8,))[::reflection].copy()
+            q[..., 3] *= reflection
+            q[..., 7] *= reflection
+            hits[i, j] = q
+            codes[i, j] = status.reshape(shape)[::reflection]
+        hits.flush()
+        codes.flush()
+    return (len(fP), bincount(status, minlength=ESCAPED + 1), 
+            (getpid(), start, time()))
+
 
 class Image:
     '''
     Image class
-    Creates the photon list and generates the image
+    Creates the photons and generates the image
     '''
     def __init__(self):
-        pass
+        self.progress = Progress(0, mode='silent')
 
-    def create_photons(self, blackhole, detector):
+    def create_photons(self, blackhole, detector, r_start=None):
         '''
-        Creates the photon list
+        Creates the PhotonBundle with all the photons of the detector.
+        If r_start is given, the weak field leg of the trajectories down to
+        that radius is skipped with the analytic approximation in far_field.
+        At r_start = 30M this saves ~15% of the integration time and moves
+        the hit radii by ~1e-2 M (the error decreases as 1/r_start^2).
         '''
         self.detector = detector
-        self.photon_list = []
-        i=0
-        for a in self.detector.alphaRange:
-            j = 0
-            for b in self.detector.betaRange:
-                p = Photon(alpha=a, beta=b)
-                p.xin, p.kin = self.detector.photon_coords(a, b) 
-                p.i, p.j = i, j
-                p.initial_conditions(blackhole)
-                self.photon_list.append(p)
-                j += 1
-            i += 1
+        self.r_start = r_start
+        self.photons = tile_photons(blackhole, detector, 
+                                    (0, detector.numPixels), r_start=r_start)
+        self.done = zeros(len(self.photons), dtype=bool)
+        self.resumed = False
+        self.checkpoint = None
+
+    def resume(self, filename, config=None):
+        '''
+        Loads the photons already traced from a checkpoint (see 
+        checkpoint.py), so create_image only traces the missing pixels.
+        If config is given, it must coincide with the configuration of the 
+        run stored in the checkpoint.
+        '''
+        fP, status, done = load_checkpoint(filename, config)
+        self.photons.fP[done] = fP[done]
+        self.photons.status[done] = status[done]
+        self.done[:] = done
+        self.resumed = True
+
+    @property
+    def photon_list(self):
+        '''
+        List of the photons as Photon views of self.photons
+        '''
+        return list(self.photons)
     
-    def create_image(self, blackhole, acc_structure):
+    def create_image(self, blackhole, acc_structure, method='odeint',
+                     tile_size=4096, workers=None, tile_side=None, 
+                     classify=False, adaptive=False, checkpoint=None, 
+                     progress='text', cache=None, n_cross=4, r_max=None,
+                     layers=None, composite=False):
         '''
         Creates the image data 
+        =======================================================================
+        method : 'odeint' integrates each photon separately with geo_integ.
+                 'events' integrates each photon separately with 
+                 geo_integ_events, which stops at the first event.
+                 'lockstep' advances tiles of tile_size photons together 
+                 with the adaptive integrator in lockstep.py. Against the
+                 'elliptic' method on a 300x300 frame at D = 100M with the
+                 disk between 3M and 20M, all three find the same hits, 
+                 with hit radii off by up to 2.5e-4 M for 'lockstep', 
+                 7e-5 M for 'events' and 8e-4 M for 'odeint' (whose 99th
+                 percentiles are about 1e-4 M).
+                 'transfer' integrates the in-plane orbits for a 1D set of
+                 impact parameters and interpolates the disk crossing of 
+                 each pixel from them (see transfer.py). It only applies to
+                 spherically symmetric black holes, and its hit radii are 
+                 off by up to 7e-2 M near the photon ring.
+                 'elliptic' solves the orbit equation in closed form with
+                 Jacobi elliptic functions (see elliptic.py) and follows 
+                 every crossing of each orbit. Its hit radii agree within 
+                 1.4e-6 M with lockstep at rtol=1e-11 on a 300x300 frame, 
+                 so it serves as a reference for the other methods in the 
+                 Schwarzschild metric.
+        workers : if given, the detector is split in tiles of tile_side
+                  pixels that are traced in a pool of this number of 
+                  processes (see create_image_parallel)
+        classify : if True, the photons that surely fall into the black hole
+                   or miss the disk are found from their impact parameter
+                   (see elliptic.classify_photons) and only the rest are 
+                   traced by the numerical methods
+        adaptive : if True, the numerical methods trace a coarse grid of 
+                   pixels and refine it only where the image changes (see
+                   create_image_adaptive), in this process
+        checkpoint : a Checkpoint where the progress of the numerical 
+                     methods is saved periodically. The pixels loaded by 
+                     resume just before this call are not traced again. 
+                     Otherwise all the pixels are traced, so the same 
+                     Image can render other accretion structures.
+        progress : mode of the progress reports, 'text', 'json' or 'silent'
+                   (see progress.py)
+        cache : a HitCache (see hitcache.py). If given, the first n_cross 
+                crossings of the equatorial plane inside r_max of the 
+                photons are read from the cache, or traced and stored in it
+                (see trace_crossings), and the image is shaded from them 
+                (see shade_crossings). The crossings are traced in this 
+                process, so workers, adaptive and checkpoint do not apply 
+                in this case and raise a ValueError.
+        layers : if given, the first layers crossings of the equatorial plane
+                 of the photons are recorded in a single pass (see 
+                 trace_crossings, or the cache) and the images of each
+                 order are shaded with shade_layers. If composite is True,
+                 image_data is their sum (a transparent disk). Otherwise it
+                 is the image of the first hit (an opaque disk). With a 
+                 cache, at least layers crossings are recorded. As with the
+                 cache, workers, adaptive and checkpoint raise a ValueError.
+        An accretion structure with the flag volumetric (see thick_torus.py)
+        is rendered with trace_volume, only with the 'lockstep' method and
+        in this process. workers, adaptive, cache and layers do not apply 
+        to it and raise a ValueError. classify (which only concerns the 
+        equatorial plane) and checkpoint are not used.
+        If the black hole and the accretion structure declare the mirror 
+        symmetry of the image about alpha = 0 (see mirror_symmetric), the 
+        numerical methods only trace the half with alpha < 0 and the other
+        half is filled by reflection.
+        =======================================================================
+        '''
+        check_method(method, ('odeint', 'events', 'lockstep', 'transfer', 
+                              'elliptic'))
+        # The pixels of a previous render are only kept after resume
+        if not self.resumed:
+            self.done[:] = False
+        self.resumed = False
+        check_r_start(self.r_start, acc_structure.out_edge)
+        if getattr(acc_structure, 'volumetric', False):
+            if method != 'lockstep':
+                raise ValueError("Volumetric emission is only integrated "
+                                 "with the 'lockstep' method")
+            if workers or adaptive or cache is not None or layers:
+                raise ValueError('Volumetric emission is not rendered with '
+                                 'workers, adaptive, cache or layers')
+            self.trace_volume(blackhole, acc_structure, tile_size, 
+                              progress=progress)
+            self.done[:] = True
+            return
+        if (cache is not None or layers) \
+                and (workers or adaptive or checkpoint is not None):
+            raise ValueError('The crossings of the cache and the layers are '
+                             'not traced with workers, adaptive or '
+                             'checkpoint')
+        if layers and cache is None:
+            self.trace_crossings(blackhole, method, layers, 
+                                 acc_structure.out_edge, tile_size, classify,
+                                 progress)
+            self.done[:] = True
+            self.shade_crossings(acc_structure)
+            self.shade_layers(acc_structure, layers, composite)
+            return
+        if cache is not None:
+            r_max = self.crossing_radius(blackhole, r_max)
+            if layers:
+                n_cross = max(n_cross, layers)
+            config = cache_config(blackhole, self.detector, method, n_cross,
+                                  r_max, self.r_start)
+            # The crossings are stored in units of M, so they are valid 
+            # for any mass with the same detector and r_max in units of M
+            arrays = cache.load(config)
+            if arrays is None:
+                self.trace_crossings(blackhole, method, n_cross, r_max, 
+                                     tile_size, classify, progress)
+                cache.store(config, 
+                            crossings=to_units_of_M(self.crossings, 
+                                                    blackhole.M),
+                            order=self.crossing_order, fate=self.fate)
+            else:
+                self.progress.message('Crossings read from the cache')
+                self.crossings = from_units_of_M(arrays['crossings'], 
+                                                 blackhole.M)
+                self.crossing_order = arrays['order']
+                self.fate = arrays['fate']
+                self.r_max = r_max
+            self.done[:] = True
+            self.shade_crossings(acc_structure)
+            if layers:
+                self.shade_layers(acc_structure, layers, composite)
+            return
+
+        mirror = self.mirror_symmetric(blackhole, acc_structure)
+        self.checkpoint = checkpoint
+        if method == 'transfer':
+            table = TransferTable(blackhole, self.detector)
+            fP, status, order = table.trace(self.photons.alpha, 
+                                            self.photons.beta,
+                                            acc_structure.in_edge,
+                                            acc_structure.out_edge)
+            self.photons.fP[:], self.photons.status[:] = fP, status
+        elif method == 'elliptic':
+            fP, status, order = elliptic_trace(self.photons, blackhole, 
+                                               self.detector,
+                                               acc_structure.in_edge,
+                                               acc_structure.out_edge)
+            self.photons.fP[:], self.photons.status[:] = fP, status
+        elif workers and not adaptive:
+            self.progress = Progress(0, mode=progress)
+            self.create_image_parallel(blackhole, acc_structure, method, 
+                                       workers, tile_side, classify, mirror)
+        else:
+            traced = self.photons.i < self.detector.numPixels//2 if mirror \
+                     else full(len(self.photons), True)
+            if classify:
+                status = classify_photons(self.photons, blackhole, 
+                                          self.detector, 
+                                          acc_structure.in_edge, 
+                                          acc_structure.out_edge)
+                classified = ~self.done & (status != INCOMPLETE)
+                self.photons.fP[classified] = 0.
+                self.photons.status[classified] = status[classified]
+                self.done |= classified
+            traced &= ~self.done
+            # For the adaptive method this is an upper bound
+            self.progress = Progress(int(traced.sum()), mode=progress)
+            if adaptive:
+                n = self.detector.numPixels
+                self.create_image_adaptive(blackhole, acc_structure, method,
+                                           tile_size, traced, 
+                                           n//2 if mirror else n)
+            else:
+                self.create_image_serial(blackhole, acc_structure, method, 
+                                         tile_size, nonzero(traced)[0])
+            self.progress.total = self.progress.done
+            self.progress.finish()
+        if mirror and method not in ('transfer', 'elliptic'):
+            self.mirror()
+        if method in ('transfer', 'elliptic'):
+            self.done[:] = True
+        if checkpoint is not None:
+            checkpoint.save(self.photons, self.done, force=True)
+            checkpoint.wait()
+        self.shade(acc_structure)
+
+    def trace_crossings(self, blackhole, method='lockstep', n_cross=4, 
+                        r_max=None, tile_size=4096, classify=False, 
+                        progress='text'):
+        '''
+        Traces the photons recording their first n_cross crossings of the 
+        equatorial plane between the horizon and r_max (see 
+        crossing_radius), which do not depend on the accretion structure
+        =======================================================================
+        method : 'lockstep', 'odeint' or 'elliptic' (see create_image)
+        classify : if True, the photons that surely fall into the black hole
+                   or never get inside r_max are not traced
+        =======================================================================
+        self.crossings : (N, n_cross, 8) states at the crossings
+        self.crossing_order : (N, n_cross) number of crossings before each 
+                              one, -1 for the missing ones
+        self.fate : (N,) final status of the photons, DISK for the photons 
+                    stopped after n_cross crossings
+        =======================================================================
+        Any accretion structure with out_edge <= r_max is then shaded with 
+        shade_crossings. Only the pixels of the photons that cross the 
+        equatorial plane more than n_cross times may differ from 
+        create_image.
+        '''
+        check_method(method, ('lockstep', 'odeint', 'elliptic'))
+        r_max = self.crossing_radius(blackhole, r_max)
+        photons = self.photons
+        N = len(photons)
+        in_edge = blackhole.EH
+        self.r_max = r_max
+        if method == 'elliptic':
+            self.crossings, self.crossing_order, self.fate = \
+                elliptic_crossings(photons, blackhole, self.detector, 
+                                   in_edge, r_max, n_cross)
+            return
+
+        self.crossings = zeros([N, n_cross, 8])
+        self.crossing_order = full([N, n_cross], -1, dtype=int8)
+        self.fate = full(N, INCOMPLETE, dtype=int8)
+        alpha = self.detector.alphaRange
+        mirror = bool(getattr(blackhole, 'mirror_symmetric', False)
+                      and allclose(alpha, -alpha[::-1]))
+        traced = photons.i < self.detector.numPixels//2 if mirror \
+                 else full(N, True)
+        if classify:
+            self.fate[:] = classify_photons(photons, blackhole, 
+                                            self.detector, in_edge, r_max)
+            traced &= self.fate == INCOMPLETE
+        index = nonzero(traced)[0]
+
+        # The geodesics are integrated in units of M (see trace)
+        M = blackhole.M
+        unit = blackhole.unit_mass()
+        self.progress = Progress(len(index), mode=progress)
+        chunk = tile_size if method == 'lockstep' else 1
+        for start in range(0, len(index), chunk):
+            tile = index[start:start + chunk]
+            iC = to_units_of_M(photons.iC[tile], M)
+            if method == 'lockstep':
+                crossings, order, status = \
+                    lockstep_integ(iC, unit, in_edge/M, r_max/M, 
+                                   n_cross=n_cross)
+            else:
+                crossings, order, status = \
+                    geo_crossings(iC[0], unit, in_edge/M, r_max/M, n_cross)
+            self.crossings[tile] = from_units_of_M(crossings, M)
+            self.crossing_order[tile] = order
+            self.fate[tile] = status
+            self.progress.update(len(tile), self.fate[tile])
+        self.progress.finish()
+
+        if mirror:
+            source, target = self.mirror_index()
+            self.crossings[target] = self.crossings[source]
+            self.crossings[target, :, 3] *= -1.
+            self.crossings[target, :, 7] *= -1.
+            self.crossing_order[target] = self.crossing_order[source]
+            self.fate[target] = self.fate[source]
+
+    def trace_volume(self, blackhole, acc_structure, tile_size=4096, 
+                     tau_max=10., progress='text'):
+        '''
+        Integrates the emission and absorption of a volumetric accretion 
+        structure along the rays with lockstep_integ, which stops each ray 
+        when its optical depth reaches tau_max. The rays are integrated in
+        units of M (see trace).
+        =======================================================================
+        self.tau : (n, n) optical depth along the ray of each pixel
+        self.image_data : (n, n) intensity received at each pixel
+        =======================================================================
+        '''
+        M = blackhole.M
+        unit = blackhole.unit_mass()
+        model = acc_structure.in_units_of_M(M)
+        photons = self.photons
+        N = len(photons)
+        mirror = self.mirror_symmetric(blackhole, acc_structure)
+        index = nonzero(photons.i < self.detector.numPixels//2)[0] if mirror\
+                else arange(N)
+        tau, intensity = zeros(N), zeros(N)
+
+        self.progress = Progress(len(index), mode=progress)
+        for start in range(0, len(index), tile_size):
+            tile = index[start:start + tile_size]
+            fP, status, tau[tile], intensity[tile] = \
+                lockstep_integ(to_units_of_M(photons.iC[tile], M), unit, 
+                               model.in_edge, model.out_edge, 
+                               emission=model, tau_max=tau_max)
+            photons.fP[tile] = from_units_of_M(fP, M)
+            photons.status[tile] = status
+            self.progress.update(len(tile), status)
+        self.progress.finish()
+        if mirror:
+            source, target = self.mirror_index()
+            self.mirror()
+            tau[target], intensity[target] = tau[source], intensity[source]
+
+        # I = freq^3 (I/freq^3), with the frequency of the static observer
+        freq = -photons.iC[:, 4]/sqrt(1. - 2.*M/self.detector.D)
+        n = self.detector.numPixels
+        self.tau = zeros([n, n])
+        self.tau[photons.i, photons.j] = tau
+        self.image_data = zeros([n, n])
+        self.image_data[photons.i, photons.j] = freq**3*intensity
+
+    def crossing_radius(self, blackhole, r_max=None):
+        '''
+        Radius up to which trace_crossings records the crossings: r_max,
+        by default 50M or r_start if it is smaller. It cannot be larger 
+        than r_start, where far_field leaves the photons.
+        '''
+        if r_max is None:
+            r_max = 50.*blackhole.M
+            if self.r_start is not None:
+                r_max = min(r_max, self.r_start)
+        elif self.r_start is not None and r_max > self.r_start:
+            raise ValueError('r_max = %g cannot be larger than r_start = %g'
+                             % (r_max, self.r_start))
+        return r_max
+
+    def shade_crossings(self, acc_structure):
+        '''
+        Takes the first crossing recorded by trace_crossings that hits the
+        accretion structure as the final state of each photon, and shades 
+        the image. It only takes milliseconds, so other accretion 
+        structures can be shaded from the same crossings.
+        '''
+        in_edge, out_edge = acc_structure.in_edge, acc_structure.out_edge
+        if out_edge > self.r_max:
+            raise ValueError('The crossings were recorded up to r_max = %g,'
+                             ' below the outer edge %g' 
+                             % (self.r_max, out_edge))
+        r = self.crossings[:, :, 1]
+        hits = (self.crossing_order >= 0) & (r > in_edge) & (r < out_edge)
+        hit = hits.any(axis=1)
+        first = argmax(hits, axis=1)
+        photons = self.photons
+        photons.fP[:] = 0.
+        photons.fP[hit] = self.crossings[hit, first[hit]]
+        photons.status[:] = where(hit, DISK, where(self.fate == DISK, 
+                                                   INCOMPLETE, self.fate))
+        self.shade(acc_structure)
+
+    def mirror_symmetric(self, blackhole, acc_structure):
+        '''
+        True if the image is symmetric under the reflection alpha -> -alpha.
+        This requires a metric invariant under phi -> -phi (the flag 
+        mirror_symmetric of the black hole), an emission that does not 
+        depend on phi (the flag axisymmetric of the accretion structure) and
+        a symmetric grid of pixels in alpha. Classes without these flags are
+        treated as asymmetric.
+        '''
+        alpha = self.detector.alphaRange
+        return bool(getattr(blackhole, 'mirror_symmetric', False)
+                    and getattr(acc_structure, 'axisymmetric', False)
+                    and allclose(alpha, -alpha[::-1]))
+
+    def mirror(self):
+        '''
+        Fills the pixels with alpha > 0 from their reflections i -> n-1-i, 
+        with phi -> -phi and k_phi -> -k_phi
         '''
-        self.image_data = zeros([self.detector.numPixels, self.detector.numPixels])
-        photon=1
-        for p in self.photon_list:
-            geo_integ(p, blackhole, acc_structure.in_edge, acc_structure.out_edge)
-            self.image_data[p.i, p.j] = acc_structure.spectrum(p.fP[1])
-            sys.stdout.write("\rPhoton # %d" %photon)
-            sys.stdout.flush()
-            #print('Photon #',photon)
-            photon +=1
+        source, target = self.mirror_index()
+        photons = self.photons
+        photons.fP[target] = photons.fP[source]
+        photons.fP[target, 3] *= -1.
+        photons.fP[target, 7] *= -1.
+        photons.status[target] = photons.status[source]
+        self.done[target] = self.done[source]
 
-    def plot(self, savefig=False, filename=None):
+    def mirror_index(self):
+        '''
+        Indices of the photons with alpha < 0 (source) and of their 
+        reflections with alpha > 0 (target)
+        '''
+        n = self.detector.numPixels
+        i, j = meshgrid(arange(n//2), arange(n), indexing='ij')
+        source = (i*n + j).ravel()
+        target = ((n - 1 - i)*n + j).ravel()
+        return source, target
+
+    def create_image_serial(self, blackhole, acc_structure, method, 
+                            tile_size=4096, index=None):
+        '''
+        Traces the photons in this process (only those in index, if given),
+        one by one or by tiles of tile_size photons for the lockstep method
+        '''
+        chunk = tile_size if method == 'lockstep' else 1
+        photons = self.photons
+        if index is None:
+            index = arange(len(photons))
+        for start in range(0, len(index), chunk):
+            tile = index[start:start + chunk]
+            trace(photons, blackhole, acc_structure, method, tile)
+            self.done[tile] = True
+            if self.checkpoint is not None:
+                self.checkpoint.save(photons, self.done)
+            self.progress.update(len(tile), photons.status[tile])
+
+    def create_image_adaptive(self, blackhole, acc_structure, method, 
+                              tile_size=4096, traced=None, n_rows=None, 
+                              step=8, r_jump=0.5):
+        '''
+        Traces the image with an adaptive refinement of the grid of pixels.
+        =======================================================================
+        A grid of nodes every step pixels is traced first. Each cell of the 
+        grid is split in four while its corners disagree, i.e. when they do 
+        not fall in the same class (shadow, disk or sky) or their hit radii
+        differ by more than r_jump*M. The pixels of the cells whose corners
+        agree are interpolated bilinearly from the corners.
+        traced : boolean array (N,) with the photons that must be 
+                 integrated when they are reached. The others (e.g. those 
+                 found by classify_photons) already have their final status.
+        n_rows : only the rows i < n_rows are rendered (the others are 
+                 filled by mirror)
+        =======================================================================
+        Features smaller than step pixels that fall between the nodes of 
+        the coarse grid are not resolved. The fraction of the rendered 
+        pixels that were integrated is stored in self.adaptive_fraction.
+        '''
+        n = self.detector.numPixels
+        if n_rows is None:
+            n_rows = n
+        if traced is None:
+            traced = full(len(self.photons), True)
+        photons = self.photons
+        exact = zeros([n_rows, n], dtype=bool)
+        # The pixels already traced (e.g. loaded by resume) are not 
+        # interpolated
+        done = self.done.reshape(n, n).copy()
+        r_jump = r_jump*blackhole.M
+
+        def evaluate(i, j):
+            new = ~exact[i, j]
+            i, j = i[new], j[new]
+            exact[i, j] = True
+            index = unique(i*n + j)
+            self.create_image_serial(blackhole, acc_structure, method, 
+                                     tile_size, index[traced[index]])
+
+        def nodes(size):
+            return unique(append(arange(0, size, step), size - 1))
+
+        # Coarse grid
+        ni, nj = nodes(n_rows), nodes(n)
+        i, j = meshgrid(ni, nj, indexing='ij')
+        evaluate(i.ravel(), j.ravel())
+        ai, aj = meshgrid(ni[:-1], nj[:-1], indexing='ij')
+        bi, bj = meshgrid(ni[1:], nj[1:], indexing='ij')
+        cells = [x.ravel() for x in (ai, bi, aj, bj)]
+
+        while cells[0].size:
+            ai, bi, aj, bj = cells
+            corners = [ai*n + aj, bi*n + aj, ai*n + bj, bi*n + bj]
+            status = array([photons.status[k] for k in corners])
+            kind = where(status == DISK, 2, where(status == CAPTURED, 1, 0))
+            r = array([photons.fP[k, 1] for k in corners])
+            jump = r.max(axis=0) - r.min(axis=0) > r_jump
+            disagree = (kind.min(axis=0) != kind.max(axis=0)) \
+                        | ((kind[0] == 2) & jump)
+            large = (bi - ai > 1) | (bj - aj > 1)
+
+            # Interpolation in the cells whose corners agree
+            for c in nonzero(~disagree & large)[0]:
+                ci, cj = meshgrid(arange(ai[c], bi[c] + 1), 
+                                  arange(aj[c], bj[c] + 1), indexing='ij')
+                fill = ~exact[ci, cj] & ~done[ci, cj]
+                ci, cj = ci[fill], cj[fill]
+                wi = ((ci - ai[c])/(bi[c] - ai[c]))[:, None]
+                wj = ((cj - aj[c])/(bj[c] - aj[c]))[:, None]
+                f = [photons.fP[k[c]] for k in corners]
+                k = ci*n + cj
+                photons.fP[k] = (1. - wi)*(1. - wj)*f[0] + wi*(1. - wj)*f[1] \
+                                + (1. - wi)*wj*f[2] + wi*wj*f[3]
+                photons.status[k] = status[0, c]
+
+            # Subdivision of the cells whose corners disagree
+            split = disagree & large
+            ai, bi, aj, bj = ai[split], bi[split], aj[split], bj[split]
+            mi, mj = (ai + bi)//2, (aj + bj)//2
+            children = [concatenate(x) for x in 
+                        zip((ai, mi, aj, mj), (mi, bi, aj, mj), 
+                            (ai, mi, mj, bj), (mi, bi, mj, bj))]
+            ai, bi, aj, bj = children
+            keep = (bi > ai) & (bj > aj)
+            cells = [x[keep] for x in children]
+            ai, bi, aj, bj = cells
+            evaluate(concatenate([ai, bi, ai, bi]), 
+                     concatenate([aj, aj, bj, bj]))
+        self.adaptive_fraction = traced[:n_rows*n][exact.ravel()].sum() \
+                                 /float(n_rows*n)
+        self.done[:n_rows*n] = True
+
+    def create_image_parallel(self, blackhole, acc_structure, method, workers,
+                              tile_side=None, classify=False, mirror=False):
+        '''
+        Traces the image by square tiles of tile_side pixels (by default 
+        about 16 tiles per worker) in a pool of processes and assembles the
+        image data. The tiles are submitted in decreasing order of their 
+        estimated cost (ray_cost), and each worker takes the next one as 
+        soon as it is free, so the expensive tiles do not leave workers 
+        idle at the end of the render. The busy and idle times of each 
+        worker are stored in self.worker_stats. If mirror is True, only the
+        rows with alpha < 0 are traced. The progress is reported through 
+        self.progress.
+        '''
+        n = self.detector.numPixels
+        n_rows = n//2 if mirror else n
+        if tile_side is None:
+            tile_side = max(8, -(-n//int(sqrt(16*workers))))
+        done = self.done.reshape(n, n)
+        tiles = [(cost, rows, cols) for cost, rows, cols 
+                 in detector_tiles(blackhole, self.detector, tile_side, n_rows)
+                 if not done[rows[0]:rows[1], cols[0]:cols[1]].all()]
+        self.progress.total = sum((rows[1] - rows[0])*(cols[1] - cols[0])
+                                  for cost, rows, cols in tiles)
+
+        self.worker_stats = {}
+        start = time()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tasks = [pool.submit(trace_tile, blackhole, self.detector, 
+                                 acc_structure, rows, cols, method,
+                                 self.r_start, classify)
+                     for cost, rows, cols in tiles]
+            for task in as_completed(tasks):
+                i, j, fP, status, (pid, t0, t1) = task.result()
+                self.photons.fP[i*n + j] = fP
+                self.photons.status[i*n + j] = status
+                self.done[i*n + j] = True
+                if self.checkpoint is not None:
+                    self.checkpoint.save(self.photons, self.done)
+                stats = self.worker_stats.setdefault(pid, {'tiles': 0, 
+                                                           'busy': 0.})
+                stats['tiles'] += 1
+                stats['busy'] += t1 - t0
+                self.progress.update(len(fP), status)
+        wall = time() - start
+        self.progress.finish()
+        for pid, stats in sorted(self.worker_stats.items()):
+            stats['idle'] = wall - stats['busy']
+            self.progress.message('Worker %d: %d tiles, busy %.2f s, '
+                                  'idle %.2f s' %(pid, stats['tiles'], 
+                                                  stats['busy'], 
+                                                  stats['idle']))
+
+    def render_memmap(self, blackhole, detector, acc_structure, filename, 
+                      method='lockstep', workers=None, tile_side=256,
+                      classify=False, r_start=None, records=False, 
+                      progress='text'):
+        '''
+        Renders the image directly into the memory-mapped file filename 
+        (.npy) tile by tile, without creating the photons of the whole 
+        detector, so the image can be larger than the memory.
+        =======================================================================
+        workers : if given, the tiles are rendered by a pool of this number 
+                  of processes, which write their tiles into the file
+        records : if True, the final states (n, n, 8) and status (n, n) of 
+                  the photons are also stored in the files given by 
+                  record_files(filename)
+        progress : mode of the progress reports (see progress.py)
+        =======================================================================
+        Tiles are traced as in create_image_parallel, with the mirror 
+        symmetry and the classification of the photons if they apply, by 
+        the methods 'odeint', 'events', 'lockstep' or 'elliptic'.
+        self.image_data is the image opened in read-only mode.
+        '''
+        check_method(method, ('odeint', 'events', 'lockstep', 'elliptic'))
+        if getattr(acc_structure, 'volumetric', False):
+            raise ValueError("Volumetric emission is not rendered by "
+                             "render_memmap, use create_image with the "
+                             "'lockstep' method")
+        check_r_start(r_start, acc_structure.out_edge)
+        self.detector = detector
+        n = detector.numPixels
+        mirror = self.mirror_symmetric(blackhole, acc_structure)
+        open_memmap(filename, mode='w+', dtype=float, shape=(n, n)).flush()
+        if records:
+            fP_file, status_file = record_files(filename)
+            open_memmap(fP_file, mode='w+', dtype=float, 
+                        shape=(n, n, 8)).flush()
+            open_memmap(status_file, mode='w+', dtype=int8, 
+                        shape=(n, n)).flush()
+
+        tiles = detector_tiles(blackhole, detector, tile_side, 
+                               n//2 if mirror else n)
+        args = [(blackhole, detector, acc_structure, rows, cols, method, 
+                 filename, r_start, classify, mirror, records)
+                for cost, rows, cols in tiles]
+        self.progress = Progress(sum((rows[1] - rows[0])*(cols[1] - cols[0])
+                                     for cost, rows, cols in tiles), 
+                                 mode=progress)
+        if workers:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                tasks = [pool.submit(render_tile, *a) for a in args]
+                for task in as_completed(tasks):
+                    n_photons, counts, stats = task.result()
+                    self.progress.update(n_photons, counts=counts)
+        else:
+            for a in args:
+                n_photons, counts, stats = render_tile(*a)
+                self.progress.update(n_photons, counts=counts)
+        self.progress.finish()
+        self.image_data = open_memmap(filename, mode='r')
+
+    def shade(self, acc_structure):
+        '''
+        Fills the image data from the hit radii of the traced photons.
+        Shading is independent of tracing, so it can be repeated cheaply
+        with another emission model of the accretion structure.
+        =======================================================================
+        self.hit_radius : radius where the photon of each pixel hits the 
+                          accretion structure, NaN for the other pixels
+        =======================================================================
+        '''
+        n = self.detector.numPixels
+        photons = self.photons
+        self.hit_radius = full([n, n], nan)
+        self.hit_radius[photons.i, photons.j] = where(photons.status == DISK,
+                                                      photons.fP[:, 1], nan)
+        self.image_data = acc_structure.spectrum(self.hit_radius)
+
+    def shade_layers(self, acc_structure, orders=None, composite=False):
+        '''
+        Creates the images of the first orders (all the recorded ones by 
+        default) crossings of the equatorial plane, from the crossings 
+        recorded by trace_crossings. The layer n is the image of the 
+        photons that hit the accretion structure at their crossing n 
+        (0 is the direct image, 1 the secondary image and n >= 2 the photon
+        ring images), as seen through a transparent disk.
+        =======================================================================
+        composite : if True, image_data is the sum of the layers
+        =======================================================================
+        self.layer_radius : (orders, n, n) hit radius of each layer, NaN for
+                            the pixels without a hit of that order
+        self.layer_data : (orders, n, n) image data of each layer
+        =======================================================================
+        '''
+        if orders is None:
+            orders = self.crossings.shape[1]
+        n = self.detector.numPixels
+        photons = self.photons
+        r = self.crossings[:, :, 1]
+        inside = (r > acc_structure.in_edge) & (r < acc_structure.out_edge)
+        self.layer_radius = full([orders, n, n], nan)
+        for k in range(orders):
+            p, slot = nonzero(inside & (self.crossing_order == k))
+            self.layer_radius[k, photons.i[p], photons.j[p]] = r[p, slot]
+        self.layer_data = acc_structure.spectrum(self.layer_radius)
+        if composite:
+            self.image_data = self.layer_data.sum(axis=0)
+
+    def shade_bands(self, blackhole, acc_structure, freqs):
+        '''
+        Creates the images at the observed frequencies freqs from the final
+        states of the photons. The geodesics do not depend on the frequency
+        (it only scales the momentum), so the photons are traced once and 
+        each pixel is shaded with I_obs(freq) = g^3 I(r, freq/g), where g 
+        is the redshift factor of its photon (see thin_disk.redshift).
+        The accretion structure must define the methods intensity and 
+        redshift.
+        =======================================================================
+        self.redshift : redshift factor g of each pixel, NaN for the pixels
+                        that do not hit the accretion structure
+        self.band_data : (len(freqs), n, n) image data at each frequency
+        =======================================================================
+        '''
+        n = self.detector.numPixels
+        photons = self.photons
+        hit = photons.status == DISK
+        self.redshift = full([n, n], nan)
+        self.redshift[photons.i[hit], photons.j[hit]] = \
+            acc_structure.redshift(photons.fP[hit], blackhole, 
+                                   self.detector.D)
+        r = full([n, n], nan)
+        r[photons.i[hit], photons.j[hit]] = photons.fP[hit, 1]
+        g = self.redshift
+        freqs = asarray(freqs, dtype=float)[:, None, None]
+        self.band_data = where(isfinite(g), 
+                               g**3*acc_structure.intensity(r, freqs/g), 0.)
+
+    def plot(self, savefig=False, filename=None, show=True):
         '''
         Plots the image of the BH 
+        matplotlib is only imported here, so the renders that do not plot 
+        (see save) do not depend on it.
         '''
+        import matplotlib.pyplot as plt
         ax = plt.figure().add_subplot(aspect='equal')
         ax.imshow(self.image_data.T, cmap = 'inferno', origin='lower')
         ax.set_xlabel(r'$\alpha$')
         ax.set_ylabel(r'$\beta$')
         if savefig:
             plt.savefig(filename)
-        plt.show()
+        if show:
+            plt.show()
+
+    def save(self, filename, cmap='inferno', vmin=None, vmax=None):
+        '''
+        Writes the image data to a .png (8-bit), .tif (16-bit) or .npy file
+        without creating a figure (see writers.py), with the orientation of
+        plot
+        '''
+        save_image(filename, self.image_data, cmap, vmin, vmax)
 
 
 
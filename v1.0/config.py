@@ -9,6 +9,7 @@ Parameters to create the Black Hole image
 from numpy import pi
 from schwarzschild import *
 from thin_disk import *
+from thick_torus import *
 from image_plane import *
 
 ###############################################################################
@@ -41,12 +42,39 @@ detector = image_plane(D=D, iota = iota, s_side = screen_side, n_pixels = n_pixe
 R_min = 6*M
 R_max = 20*M
 acc_structure = thin_disk(R_min, R_max)
+# Volumetric emission (with method = 'lockstep'):
+#acc_structure = thick_torus(R_c=10*M, width=2*M, j0=1., kappa0=0.)
+
+
+###############################################################################
+############################## RENDER PARAMETERS ##############################
+###############################################################################
+method = 'odeint'   # 'odeint', 'events', 'lockstep', 'transfer' or 'elliptic'
+workers = None      # Number of processes used to trace the image
+r_start = None      # Radius where the integration starts (e.g. 30*M)
+classify = True     # Skip the photons that surely miss the disk
+adaptive = False    # Refine a coarse grid only where the image changes
+checkpoint_file = 'BlackHole.ckpt.npz'   # Checkpoint of the render
+checkpoint_interval = 300.   # Seconds between checkpoints
+output_file = None  # .npy file to render large images tile by tile
+progress = 'text'   # Progress reports: 'text', 'json' or 'silent'
+cache_dir = None    # Directory of the cache of crossings (e.g. 'cache')
+cache_size = 2**30  # Maximum size of the cache in bytes
+n_cross = 4         # Crossings of the equatorial plane stored in the cache
+r_max = None        # Maximum radius of the crossings in the cache (50M)
+bands = None        # Observed frequencies of a multi-band image, e.g. [1, 2]
+layers = None       # Orders of the images of the disk recorded, e.g. 3
+composite = False   # Sum the layers (transparent disk)
 
 
 ###############################################################################
 ############################### IMAGE FILENAME ################################
 ###############################################################################
 filename = 'BlackHole.jpeg'
+show = True         # If False, the image is written without matplotlib and
+                    # filename must be a .png, .tif or .npy file
+bands_file = 'BlackHole_bands.npy'   # Stack of the multi-band images
+layers_file = 'BlackHole_layers.npy' # Images of each order
 
 
 
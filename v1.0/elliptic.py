@@ -0,0 +1,273 @@
+"""
+===============================================================================
+Closed-form ray solver for the Schwarzschild metric
+
+In the plane of its orbit, a photon with energy E = -k_t, total angular
+momentum L and Hamiltonian H = g^{mu nu} k_mu k_nu / 2 satisfies
+
+(du/dpsi)^2 = 2M u^3 - u^2 - (4HM/L^2) u + (E^2 + 2H)/L^2,     u = 1/r
+
+which for null geodesics (H = 0) is the usual orbit equation
+(du/dpsi)^2 = 1/b^2 - u^2 + 2M u^3. Its solution is written in terms of
+Jacobi elliptic functions, so the radius of the n-th crossing of the
+equatorial plane is obtained for every pixel without any ODE integration.
+===============================================================================
+"""
+
+from numpy import sqrt, sin, cos, arccos, arcsin, cbrt, pi, zeros, full, \
+                  nan, where, clip, sort, stack, errstate, int8, array, \
+                  arctan2, cross, nonzero
+from scipy.special import ellipj, ellipk, ellipkinc
+from lockstep import INCOMPLETE, CAPTURED, DISK, ESCAPED
+from transfer import crossing_angles, crossing_state
+
+
+def orbit_roots(M, c1, c0):
+    '''
+    Roots of the cubic 2M u^3 - u^2 + c1 u + c0 for arrays of coefficients.
+    Returns the mask of the cubics with three real roots, the sorted roots
+    (u1, u2, u3) for those, and for the others the real root u1 in the
+    first place and the real and imaginary parts of the complex pair.
+    '''
+    # Depressed cubic y^3 + p y + q with u = y + 1/(6M)
+    p = (6.*M*c1 - 1.)/(12.*M**2)
+    q = (-2. + 18.*M*c1 + 108.*M**2*c0)/(216.*M**3)
+    disc = (q/2.)**2 + (p/3.)**3
+    three = disc < 0.
+
+    with errstate(invalid='ignore'):
+        # Three real roots (trigonometric form)
+        p_n = where(three, p, -1.)
+        theta = arccos(clip((3.*q/(2.*p_n))*sqrt(-3./p_n), -1., 1.))
+        y = stack([2.*sqrt(-p_n/3.)*cos(theta/3. - 2.*pi*k/3.)
+                   for k in range(3)])
+        real_roots = sort(y, axis=0) + 1./(6.*M)
+
+        # One real root (Cardano) and a complex pair
+        s = sqrt(where(three, 0., disc))
+        u1 = cbrt(-q/2. + s) + cbrt(-q/2. - s) + 1./(6.*M)
+        re = (1./(2.*M) - u1)/2.
+        im = sqrt(abs(-c0/(2.*M*u1) - re**2))
+
+    roots = where(three, real_roots, stack([u1, re, im]))
+    return three, roots
+
+
+class Orbits:
+    '''
+    ===========================================================================
+    Parameters of the in-plane orbits of the photons of a PhotonBundle in
+    terms of the elliptic argument xi, which grows linearly with the angle
+    psi swept around the black hole, xi = g*(psi - psi_start) + xi0
+    ===========================================================================
+    three : True for the turning orbits (three real roots), which reach the
+            periastron 1/u2 and escape, False for the plunging orbits
+    xi0, xi_end : values of xi at the initial position and where the orbit
+                  escapes to infinity or reaches the event horizon
+    psi_start, psi_first : angle of the initial position, measured from the
+                           direction of the observer, and angle of the first
+                           crossing of the equatorial plane
+    ===========================================================================
+    '''
+    def __init__(self, photons, blackhole, detector):
+        M = blackhole.M
+        q = photons.iC
+        g_tt, g_rr, g_thth, g_phph = blackhole.metric(q[:, :4].T)
+        self.M = M
+        self.E = -q[:, 4]
+        L2 = q[:, 6]**2 + q[:, 7]**2/sin(q[:, 2])**2
+        self.H = 0.5*(q[:, 4]**2/g_tt + q[:, 5]**2/g_rr + L2/g_thth)
+        u0 = 1./q[:, 1]
+        self.radial = L2 <= 0.
+        self.L2 = where(self.radial, 1., L2)
+        self.three, (u1, u2, u3) = orbit_roots(M, -4.*self.H*M/self.L2,
+                                               (self.E**2 + 2.*self.H)/self.L2)
+        three = self.three
+        self.u1, self.u2, self.u3 = u1, u2, u3
+
+        with errstate(invalid='ignore', divide='ignore'):
+            # Turning orbits, u = u1 + (u2 - u1) sn^2(xi, m)
+            m_A = where(three, (u2 - u1)/(u3 - u1), 0.5)
+            g_A = sqrt(2.*M*abs(u3 - u1))/2.
+            xi0_A = ellipkinc(arcsin(sqrt(clip((u0 - u1)/(u2 - u1), 
+                                               0., 1.))), m_A)
+            xi_end_A = 2.*ellipk(m_A) - xi0_A
+
+            # Plunging orbits, u = u1 + A (1 - cn(xi, m))/(1 + cn(xi, m))
+            self.A = sqrt((u2 - u1)**2 + u3**2)
+            m_B = where(three, 0.5, (self.A + u2 - u1)/(2.*self.A))
+            g_B = sqrt(2.*M*self.A)
+            self.m = where(three, m_A, m_B)
+            xi0_B = self.xi_plunging(u0)
+            xi_end_B = self.xi_plunging(1./blackhole.EH)
+
+        self.g = where(three, g_A, g_B)
+        self.xi0 = where(three, xi0_A, xi0_B)
+        self.xi_end = where(three, xi_end_A, xi_end_B)
+
+        b, psi_start, self.psi_first = crossing_angles(photons.alpha, 
+                                                       photons.beta,
+                                                       detector.iota, 
+                                                       detector.D)
+        # Angle between the initial position and the direction of the 
+        # observer, which differs from arctan(b/D) if the photons were 
+        # moved by far_field
+        n = array([sin(q[:, 2])*cos(q[:, 3]), sin(q[:, 2])*sin(q[:, 3]),
+                   cos(q[:, 2])])
+        o = array([sin(detector.iota), 0., cos(detector.iota)])[:, None]
+        self.psi_start = arctan2(sqrt((cross(n, o, axis=0)**2).sum(axis=0)),
+                                 (n*o).sum(axis=0))
+
+    def xi(self, psi):
+        '''
+        Elliptic argument at the angle psi
+        '''
+        return self.g*(psi - self.psi_start) + self.xi0
+
+    def xi_plunging(self, u):
+        '''
+        Elliptic argument where a plunging orbit reaches u = 1/r
+        '''
+        u1, A = self.u1, self.A
+        with errstate(invalid='ignore', divide='ignore'):
+            phi = arccos(clip((A - (u - u1))/(A + (u - u1)), -1., 1.))
+        return ellipkinc(phi, self.m)
+
+    def radius(self, xi):
+        '''
+        Radius of the orbits at the elliptic argument xi
+        '''
+        sn, cn, dn, ph = ellipj(xi, self.m)
+        with errstate(invalid='ignore', divide='ignore'):
+            u = where(self.three, self.u1 + (self.u2 - self.u1)*sn**2,
+                      self.u1 + self.A*(1. - cn)/(1. + cn))
+            return 1./u
+
+
+def elliptic_trace(photons, blackhole, detector, in_edge, out_edge,
+                   orders=None):
+    '''
+    Finds analytically the first crossing of the equatorial plane with
+    in_edge < r < out_edge for the photons of a PhotonBundle, using their
+    conserved quantities from photons.iC, among all their crossings (or 
+    the first orders crossings, see elliptic_crossings)
+    ===========================================================================
+    Returns the arrays fP (N, 8), status (N,) and order (N,), with the
+    number of crossings of the equatorial plane before the hit (-1 for the
+    photons that do not hit the disk). The coordinate time of the crossing
+    is not computed and it is set to NaN.
+    ===========================================================================
+    '''
+    crossings, order, status = elliptic_crossings(photons, blackhole, 
+                                                  detector, in_edge, 
+                                                  out_edge, 1, orders)
+    return crossings[:, 0], status, order[:, 0]
+
+
+def elliptic_crossings(photons, blackhole, detector, in_edge, out_edge,
+                       n_cross, orders=None):
+    '''
+    Finds analytically the first n_cross crossings of the equatorial plane 
+    with in_edge < r < out_edge of the photons of a PhotonBundle (see 
+    elliptic_trace). The crossings are followed until every orbit reaches 
+    xi_end (it escapes or falls into the black hole), so the photons near 
+    the photon ring that wind several times are included. orders limits 
+    them to the first orders crossings (at most 127, the largest order 
+    that is stored).
+    ===========================================================================
+    Returns the arrays crossings (N, n_cross, 8) and order (N, n_cross), as
+    in lockstep_integ, and status (N,), which is DISK for the photons with
+    n_cross recorded crossings
+    ===========================================================================
+    '''
+    if orders is None:
+        orders = 127
+    M = blackhole.M
+    q = photons.iC
+    N = len(q)
+    orb = Orbits(photons, blackhole, detector)
+    E, L2, H = orb.E, orb.L2, orb.H
+
+    crossings = zeros([N, n_cross, 8])
+    crossings[:, :, 0] = nan
+    order = full([N, n_cross], -1, dtype=int8)
+    count = zeros(N, dtype=int)
+    for n in range(min(orders, 127)):
+        psi = orb.psi_first + n*pi
+        xi = orb.xi(psi)
+        # Every orbit has a finite number of crossings before xi_end
+        pending = (count < n_cross) & ~orb.radial & (xi < orb.xi_end)
+        if not pending.any():
+            break
+        r = orb.radius(xi)
+        hit = pending & (r > in_edge) & (r < out_edge)
+        if not hit.any():
+            continue
+        p, k = nonzero(hit)[0], count[hit]
+        order[p, k] = n
+        count[p] += 1
+        rh = r[hit]
+        f = 1. - 2.*M/rh
+        k_r = sqrt(clip((2.*H[hit] + E[hit]**2/f - L2[hit]/rh**2)/f, 0., None))
+        # The radial momentum changes sign at the periastron
+        outgoing = orb.three[hit] & (xi[hit] > ellipk(orb.m[hit]))
+        crossings[p, k, 1] = rh
+        crossings[p, k, 2] = pi/2
+        crossings[p, k, 4] = q[hit, 4]
+        crossings[p, k, 5] = where(outgoing, -k_r, k_r)
+        crossings[p, k, 3], crossings[p, k, 6], crossings[p, k, 7] = \
+            crossing_state(psi[hit], photons.alpha[hit], photons.beta[hit],
+                           detector.iota)
+
+    status = where(count == n_cross, DISK, 
+                   where(orb.three & ~orb.radial, 
+                         ESCAPED, CAPTURED)).astype(int8)
+    return crossings, order, status
+
+
+def classify_photons(photons, blackhole, detector, in_edge, out_edge, 
+                     margin=1e-2):
+    '''
+    Classification of the photons of a PhotonBundle before tracing them,
+    from their impact parameter and the inclination of the detector
+    ===========================================================================
+    A photon is surely CAPTURED (shadow) if its orbit plunges into the 
+    horizon (b < 3*sqrt(3)M) and it is already inside in_edge when it first
+    crosses the equatorial plane.
+    A photon surely misses the disk (ESCAPED) if its periastron lies beyond
+    out_edge, if it escapes before its first crossing of the equatorial
+    plane, or if that crossing lies beyond out_edge and after the periastron
+    (the crossing angles depend on the inclination).
+    margin : relative safety margin of both bounds, so the photons close to
+             them are still traced
+    ===========================================================================
+    Returns the array status (N,) with CAPTURED or ESCAPED for the 
+    classified photons and INCOMPLETE for those that must be traced.
+    '''
+    orb = Orbits(photons, blackhole, detector)
+    turning = orb.three & ~orb.radial
+    plunging = ~orb.three & ~orb.radial
+    swept = orb.xi(orb.psi_first) - orb.xi0
+    with errstate(invalid='ignore', divide='ignore'):
+        xi_in = orb.xi_plunging(1./max(in_edge, blackhole.EH))
+        shadow = plunging & (swept > (1. + margin)*(xi_in - orb.xi0))
+        # After the periastron the radius only grows
+        r_first = orb.radius(orb.xi(orb.psi_first))
+        receding = (swept > (1. + margin)*(ellipk(orb.m) - orb.xi0)) \
+                    & (r_first > (1. + margin)*out_edge)
+        miss = turning & ((1./orb.u2 > (1. + margin)*out_edge) | receding
+                          | (swept > (1. + margin)*(orb.xi_end - orb.xi0)))
+    status = full(len(photons), INCOMPLETE, dtype=int8)
+    status[shadow] = CAPTURED
+    status[miss] = ESCAPED
+    return status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,152 @@
+"""
+===============================================================================
+Persistent cache of the crossings of the photons
+
+The crossings of the equatorial plane of the photons of a detector depend
+only on the black hole, the detector and the integrator, not on the
+accretion structure. They are stored on disk in a directory, in files named
+after a hash of these parameters, so a new accretion structure (other
+edges or emission law) is shaded from them without tracing the photons
+again. The crossings are stored in units of M, so they also serve other
+masses with the same detector in units of M. The least recently used files
+are removed when the cache exceeds its maximum size.
+===============================================================================
+"""
+
+import hashlib
+import json
+import os
+from tempfile import mkstemp
+from zipfile import BadZipFile
+from numpy import savez, load, array
+
+
+# Changes of the format of the files or of the integrators invalidate the
+# files written by older versions
+CACHE_VERSION = 1
+
+
+def cache_config(blackhole, detector, method, n_cross, r_max, r_start=None):
+    '''
+    Parameters that determine the crossings of the photons of the detector
+    (see Image.trace_crossings), used as the key of the cache. The lengths
+    are given in units of M, so the same entry serves any mass.
+    '''
+    M = float(blackhole.M)
+
+    # The ratios are rounded so the round-off of D = 100*M, etc. does not
+    # change the key
+    def ratio(x):
+        return float('%.12g' % (float(x)/M))
+
+    return {'version': CACHE_VERSION,
+            'D': ratio(detector.D),
+            'iota': float(detector.iota),
+            's_side': ratio(detector.s_side),
+            'n_pixels': int(detector.numPixels),
+            'method': method,
+            'n_cross': int(n_cross),
+            'r_max': ratio(r_max),
+            'r_start': None if r_start is None else ratio(r_start)}
+
+
+class HitCache:
+    '''
+    ===========================================================================
+    Cache of crossings in the directory (created if it does not exist)
+    ===========================================================================
+    max_bytes : maximum total size of the files of the cache
+    ===========================================================================
+    Each entry is a .npz file named after the SHA-256 hash of its
+    configuration (see cache_config), which is also stored in the file and
+    checked when it is read. The files are written to a unique temporary 
+    file that then replaces the entry, so an interrupted write or several
+    processes storing the same entry never leave a corrupted entry. An 
+    entry that cannot be read is treated as a miss.
+    '''
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, config):
+        '''
+        Hash of the configuration
+        '''
+        text = json.dumps(config, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def path(self, config):
+        '''
+        File of the entry with the given configuration
+        '''
+        return os.path.join(self.directory, self.key(config) + '.npz')
+
+    def load(self, config):
+        '''
+        Returns a dictionary with the arrays stored for the configuration,
+        or None if it is not in the cache or cannot be read
+        '''
+        path = self.path(config)
+        if not os.path.exists(path):
+            return None
+        try:
+            with load(path) as data:
+                stored = json.loads(str(data['config']))
+                if stored != json.loads(json.dumps(config)):
+                    return None
+                arrays = {name: data[name] for name in data.files
+                          if name != 'config'}
+        except (OSError, ValueError, KeyError, EOFError, BadZipFile):
+            # The entry is traced again and replaced by the next store
+            return None
+        # The modification time records the last use of the entry
+        os.utime(path)
+        return arrays
+
+    def store(self, config, **arrays):
+        '''
+        Stores the arrays for the configuration and removes the least
+        recently used entries if the cache exceeds max_bytes
+        '''
+        path = self.path(config)
+        fd, tmp = mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                savez(f, config=array(json.dumps(config, sort_keys=True)),
+                      **arrays)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        '''
+        Removes the least recently used entries (except keep) until the
+        total size is below max_bytes
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                info = os.stat(path)
+                entries.append((info.st_mtime, info.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
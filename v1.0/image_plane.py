@@ -7,7 +7,8 @@ curved spacetime
 ===============================================================================
 """
 
-from numpy import sqrt, sin, cos, arccos, arctan, linspace
+from numpy import sqrt, sin, cos, arccos, arctan, linspace, meshgrid, \
+                  asarray, zeros_like, array
 
 
 class image_plane:
@@ -29,6 +30,7 @@ class image_plane:
         
         self.D = D 
         self.iota = iota  
+        self.s_side = s_side
         if n_pixels & 1:
             self.numPixels = n_pixels + 1
         else:
@@ -64,6 +66,39 @@ class image_plane:
         # (kt, kr, ktheta, kphi)
         kin = [kt, kr, ktheta, kphi]
         return xin, kin
+
+    def photon_coords_grid(self, alpha=None, beta=None, freq=1):
+        '''
+        Vectorized version of photon_coords for N points of the screen.
+        By default it uses the whole grid of pixels, ordered as 
+        n = i*numPixels + j for alpha = alphaRange[i], beta = betaRange[j].
+        Returns the arrays xin and kin with shape (4, N).
+        '''
+        if alpha is None or beta is None:
+            alpha, beta = meshgrid(self.alphaRange, self.betaRange, 
+                                   indexing='ij')
+        alpha = asarray(alpha, dtype=float).ravel()
+        beta = asarray(beta, dtype=float).ravel()
+        sin_i, cos_i = sin(self.iota), cos(self.iota)
+
+        # Transformation from (Alpha, Beta, D) to (r, theta, phi) 
+        r2 = alpha**2 + beta**2 + self.D**2
+        r = sqrt(r2)
+        z = beta*sin_i + self.D*cos_i
+        x = self.D*sin_i - beta*cos_i
+        theta = arccos(z/r)
+        phi = arctan(alpha/x)
+        xin = array([zeros_like(r), r, theta, phi])
+
+        # Initial 4-momentum (kt, kr, ktheta, kphi)
+        w0 = freq
+        aux = alpha**2 + x**2
+        kr = (self.D/r)*w0
+        ktheta = (w0/sqrt(aux))*(-cos_i + z*(self.D/r2))
+        kphi = - alpha*sin_i*w0/aux
+        kt = sqrt(kr**2 + r2*ktheta**2 + r2*(sin(theta))**2*kphi**2)
+        kin = array([kt, kr, ktheta, kphi])
+        return xin, kin
  
 
 
@@ -0,0 +1,239 @@
+"""
+===============================================================================
+Lockstep integrator for the geodesic equations
+
+All the photons in a tile are advanced together with an adaptive
+Dormand-Prince RK5(4) scheme. Each ray keeps its own affine parameter and
+step size, and it is masked out of the active set as soon as it crosses the
+event horizon, hits the accretion structure or escapes.
+
+For volumetric emission, the optical depth and the intensity along each ray
+are integrated as two extra components of the state, so each photon only
+needs O(1) memory, and the photon stops once the optical depth saturates.
+===============================================================================
+"""
+
+from numpy import array, asarray, zeros, ones, full, arange, sqrt, cos, \
+                  minimum, maximum, abs, isfinite, where, int8, exp, \
+                  column_stack
+
+
+# Final status of a traced photon
+INCOMPLETE = 0  # The affine parameter budget was exhausted
+CAPTURED = 1    # The photon crossed the event horizon
+DISK = 2        # The photon hit the accretion structure
+ESCAPED = 3     # The photon left the region where it can hit the disk
+
+
+# Dormand-Prince RK5(4) tableau
+A = [array([]),
+     array([1./5.]),
+     array([3./40., 9./40.]),
+     array([44./45., -56./15., 32./9.]),
+     array([19372./6561., -25360./2187., 64448./6561., -212./729.]),
+     array([9017./3168., -355./33., 46732./5247., 49./176., -5103./18656.])]
+B5 = array([35./384., 0., 500./1113., 125./192., -2187./6784., 11./84.])
+B4 = array([5179./57600., 0., 7571./16695., 393./640., -92097./339200.,
+            187./2100., 1./40.])
+E = array(list(B5) + [0.]) - B4
+
+
+def equatorial_crossing(q0, q1, f0, f1, h, iterations=8):
+    '''
+    Locates the crossing of the equatorial plane between the states q0 and 
+    q1 of N photons, separated by a step h in the affine parameter.
+    ===========================================================================
+    q0, q1 : arrays (N, 8) with the states at both ends of the step, with 
+             r*cos(theta) changing sign between them
+    f0, f1 : arrays (N, 8) with the derivatives at both ends of the step
+    h : array (N,) with the step size of each photon
+    ===========================================================================
+    The state along the step is approximated by a cubic Hermite interpolant 
+    and the root of r*cos(theta) is found with the Illinois variant of the 
+    secant method, which keeps the root bracketed.
+    Returns an array (N, 8) with the states at the crossing.
+    '''
+    h = asarray(h, dtype=float).reshape(-1, 1)
+
+    def state(s):
+        s = s[:, None]
+        s2 = s*s
+        s3 = s2*s
+        return (2.*s3 - 3.*s2 + 1.)*q0 + (s3 - 2.*s2 + s)*h*f0 \
+                + (3.*s2 - 2.*s3)*q1 + (s3 - s2)*h*f1
+
+    def z(s):
+        q = state(s)
+        return q[:, 1]*cos(q[:, 2])
+
+    a, b = zeros(len(q0)), ones(len(q0))
+    za, zb = q0[:, 1]*cos(q0[:, 2]), q1[:, 1]*cos(q1[:, 2])
+    for _ in range(iterations):
+        denom = za - zb
+        s = where(denom != 0., a + za*(b - a)/where(denom != 0., denom, 1.), a)
+        zs = z(s)
+        left = za*zs > 0.
+        # The endpoint that is kept has its value halved (Illinois)
+        zb = where(left, zb*0.5, zb)
+        za = where(left, zs, za*0.5)
+        a = where(left, s, a)
+        zb = where(left, zb, zs)
+        b = where(left, b, s)
+    return state(where(abs(za) < abs(zb), a, b))
+
+
+def lockstep_integ(iC, blackhole, in_edge, out_edge, lmbda_end=-200.,
+                   rtol=1e-8, atol=1e-10, h0=-1., r_escape=None,
+                   r_capture=None, max_steps=20000, n_cross=None,
+                   emission=None, tau_max=10.):
+    '''
+    Integrates the geodesic equations of N photons simultaneously
+    ===========================================================================
+    iC : array (N, 8) with the initial conditions
+         [t, r, theta, phi, k_t, k_r, k_th, k_phi] of each photon
+    lmbda_end : final value of the affine parameter (negative, the photons
+                are traced backwards from the image plane)
+    rtol, atol : relative and absolute tolerances of the adaptive scheme
+    h0 : initial step size
+    r_escape : an outgoing photon beyond this radius is considered escaped.
+               By default max(out_edge, 4M)
+    r_capture : an ingoing photon below this radius is considered captured.
+                By default min(in_edge, 2.5M), well inside the photon sphere
+    max_steps : maximum number of accepted steps per photon
+    n_cross : if given, the first n_cross crossings of the equatorial plane
+              with in_edge < r < out_edge are recorded for each photon
+    emission : volumetric emission model with the method 
+               coefficients(q, blackhole), which returns the invariant 
+               emissivity j/freq^2 and absorption freq*kappa at the states 
+               q (N, 8) (see thick_torus.py). The equatorial plane is then 
+               ignored and the photons stop when the optical depth reaches
+               tau_max.
+    ===========================================================================
+    Returns the arrays fP (N, 8), with the state of each photon at the disk
+    crossing (zeros for photons that do not hit the disk), and status (N,),
+    with one of INCOMPLETE, CAPTURED, DISK or ESCAPED for each photon.
+    If n_cross is given, it returns instead the arrays crossings 
+    (N, n_cross, 8) with the states at the recorded crossings, order 
+    (N, n_cross) with the number of crossings of the equatorial plane 
+    before each of them (-1 for the missing ones), and status (N,), which 
+    is DISK for the photons stopped after n_cross crossings.
+    If emission is given, it returns fP (N, 8) with the final states, status
+    (N,), which is DISK for the photons stopped by the optical depth, and
+    the arrays tau (N,) and intensity (N,) with the optical depth and the 
+    invariant intensity I/freq^3 received along each ray.
+    '''
+    M = blackhole.M
+    if r_escape is None:
+        r_escape = max(out_edge, 4.*M)
+    if r_capture is None:
+        r_capture = min(in_edge, 2.5*M)
+
+    def rhs(ys):
+        dy = blackhole.geodesics_batch(ys[:, :8], axis=1)
+        if emission is None:
+            return dy
+        # The rays are integrated backwards from the observer, so the
+        # optical depth grows as lambda decreases
+        eta, chi = emission.coefficients(ys[:, :8], blackhole)
+        return column_stack((dy, -chi, -eta*exp(-ys[:, 8])))
+
+    y = array(iC, dtype=float)
+    N = len(y)
+    if emission is not None:
+        y = column_stack((y, zeros([N, 2])))
+    n_rec = 1 if n_cross is None else n_cross
+    crossings = zeros([N, n_rec, 8])
+    order = full([N, n_rec], -1, dtype=int8)
+    count = zeros(N, dtype=int)
+    n_all = zeros(N, dtype=int)
+    status = full(N, INCOMPLETE, dtype=int8)
+    lmbda = zeros(N)
+    h = full(N, float(h0))
+    steps = zeros(N, dtype=int)
+    K1 = rhs(y)
+    active = arange(N)
+
+    while active.size:
+        ya = y[active]
+        la = lmbda[active]
+        ha = maximum(h[active], lmbda_end - la)[:, None]
+
+        # Runge-Kutta stages
+        K = [K1[active]]
+        for s in range(1, 6):
+            ys = ya + ha*sum(A[s][m]*K[m] for m in range(s))
+            K.append(rhs(ys))
+        y_new = ya + ha*sum(B5[m]*K[m] for m in range(6) if B5[m] != 0.)
+        K.append(rhs(y_new))
+
+        # Error estimate and step size control
+        err = ha*sum(E[m]*K[m] for m in range(7) if E[m] != 0.)
+        scale = atol + rtol*maximum(abs(ya), abs(y_new))
+        err_norm = sqrt(((err/scale)**2).mean(axis=1))
+        err_norm = where(isfinite(err_norm), err_norm, 1e10)
+        accept = err_norm <= 1.
+        factor = minimum(5., maximum(0.2, 0.9*maximum(err_norm, 1e-10)**-0.2))
+        factor[~accept] = minimum(factor[~accept], 1.)
+        h[active] = ha[:, 0]*factor
+
+        # Accepted steps
+        idx = active[accept]
+        y_old = ya[accept]
+        y_acc = y_new[accept]
+        y[idx] = y_acc
+        K1[idx] = K[6][accept]
+        lmbda[idx] = la[accept] + ha[accept, 0]
+        steps[idx] += 1
+
+        r_old, r_new = y_old[:, 1], y_acc[:, 1]
+        inward = r_new < r_old
+
+        # Equatorial crossing inside the disk
+        z_old = r_old*cos(y_old[:, 2])
+        z_new = r_new*cos(y_acc[:, 2])
+        crossing = (z_old*z_new <= 0.) & (z_old != z_new)
+        hit = zeros(idx.size, dtype=bool)
+        if emission is not None:
+            hit = y_acc[:, 8] > tau_max
+        elif crossing.any():
+            c = where(crossing)[0]
+            y_hit = equatorial_crossing(y_old[c], y_acc[c], K[0][accept][c],
+                                        K[6][accept][c], ha[accept][c])
+            inside = (y_hit[:, 1] > in_edge) & (y_hit[:, 1] < out_edge)
+            p = idx[c[inside]]
+            crossings[p, count[p]] = y_hit[inside]
+            order[p, count[p]] = n_all[p]
+            count[p] += 1
+            n_all[idx[c]] += 1
+            hit[c[inside]] = count[p] >= n_rec
+        status[idx[hit]] = DISK
+
+        captured = ~hit & ((r_new < blackhole.EH + 1e-5)
+                           | (inward & (r_new < r_capture)))
+        status[idx[captured]] = CAPTURED
+
+        escaped = ~hit & ~captured & ~inward & (r_new > r_escape)
+        status[idx[escaped]] = ESCAPED
+
+        done = hit | captured | escaped | (steps[idx] >= max_steps) \
+                | (lmbda[idx] <= lmbda_end*(1. - 1e-12))
+        keep = ones(active.size, dtype=bool)
+        keep[where(accept)[0][done]] = False
+        active = active[keep]
+
+    if emission is not None:
+        return y[:, :8], status, y[:, 8], y[:, 9]
+    if n_cross is None:
+        return crossings[:, 0], status
+    return crossings, order, status
+
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
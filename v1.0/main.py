@@ -7,20 +7,65 @@ Creates the Black Hole image
 ===============================================================================
 """
 
+import argparse
 from common import Image
+from checkpoint import Checkpoint, run_config
+from hitcache import HitCache
+from writers import write_npy
 from config import *
 
 
 
 #################################### MAIN #####################################
 
-image = Image()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Creates the Black Hole image')
+    parser.add_argument('--resume', action='store_true', 
+                        help='resume the render from the checkpoint file')
+    args = parser.parse_args()
 
-# Photons creation
-image.create_photons(blackhole, detector)
+    image = Image()
 
-# Create the image data
-image.create_image(blackhole, acc_structure)
+    if output_file is not None:
+        # Large images are written directly into a memory-mapped file
+        image.render_memmap(blackhole, detector, acc_structure, output_file,
+                            method=method, workers=workers, 
+                            classify=classify, r_start=r_start, 
+                            progress=progress)
+    else:
+        # Photons creation
+        image.create_photons(blackhole, detector, r_start=r_start)
 
-# Plot the image
-image.plot(savefig=True, filename=filename)
+        # Crossings of the photons reused between renders
+        cache = HitCache(cache_dir, cache_size) if cache_dir else None
+
+        # Checkpoints of the render (the crossings of the cache and the 
+        # layers are traced without them)
+        checkpoint = None
+        if cache is None and not layers:
+            run = run_config(blackhole, detector, acc_structure, method, 
+                             r_start)
+            if args.resume:
+                image.resume(checkpoint_file, run)
+            checkpoint = Checkpoint(checkpoint_file, run, 
+                                    checkpoint_interval)
+
+        # Create the image data
+        image.create_image(blackhole, acc_structure, method=method, 
+                           workers=workers, classify=classify, 
+                           adaptive=adaptive, checkpoint=checkpoint,
+                           progress=progress, cache=cache, n_cross=n_cross,
+                           r_max=r_max, layers=layers, composite=composite)
+
+        # Images at several observed frequencies from the same photons
+        if bands is not None:
+            image.shade_bands(blackhole, acc_structure, bands)
+            write_npy(bands_file, image.band_data)
+        if layers:
+            write_npy(layers_file, image.layer_data)
+
+        # Plot or save the image
+        if show:
+            image.plot(savefig=True, filename=filename)
+        else:
+            image.save(filename)
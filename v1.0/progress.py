@@ -0,0 +1,122 @@
+"""
+===============================================================================
+Progress reports of a render
+
+The reports are written at most once per interval, whatever the number of
+updates, with the fraction of photons traced, the throughput, the estimated
+time to finish and the number of photons with each final status.
+===============================================================================
+"""
+
+import json
+import sys
+from time import time
+from numpy import bincount, asarray
+from lockstep import INCOMPLETE, CAPTURED, DISK, ESCAPED
+
+
+OUTCOMES = {INCOMPLETE: 'incomplete', CAPTURED: 'captured', DISK: 'disk',
+            ESCAPED: 'escaped'}
+
+
+class Progress:
+    '''
+    ===========================================================================
+    Progress of the tracing of total photons
+    ===========================================================================
+    mode : 'text' writes a single line that is updated in place,
+           'json' writes one JSON object per line (for job monitors) and
+           'silent' writes nothing
+    interval : minimum time in seconds between two reports
+    stream : file where the reports are written (sys.stdout by default)
+    ===========================================================================
+    '''
+    def __init__(self, total, mode='text', interval=1., stream=None):
+        if mode not in ('text', 'json', 'silent'):
+            raise ValueError("mode must be 'text', 'json' or 'silent'")
+        self.total = total
+        self.mode = mode
+        self.interval = interval
+        self.stream = sys.stdout if stream is None else stream
+        self.done = 0
+        self.counts = [0]*len(OUTCOMES)
+        self.start = time()
+        self.last = self.start
+
+    def update(self, n, status=None, counts=None):
+        '''
+        Adds n traced photons, with their final status or the number of 
+        photons with each status (counts) if given, and writes a report if 
+        interval seconds have passed since the last one
+        '''
+        self.done += n
+        if status is not None:
+            counts = bincount(asarray(status).ravel(), 
+                              minlength=len(OUTCOMES))
+        if counts is not None:
+            for code, count in enumerate(counts):
+                self.counts[code] += int(count)
+        now = time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def state(self):
+        '''
+        Dictionary with the current progress
+        '''
+        elapsed = time() - self.start
+        rate = self.done/elapsed if elapsed > 0. else 0.
+        state = {'done': self.done, 'total': self.total,
+                 'fraction': self.done/self.total if self.total else 1.,
+                 'elapsed': elapsed, 'rate': rate,
+                 'eta': (self.total - self.done)/rate if rate > 0. else None}
+        for code, name in OUTCOMES.items():
+            state[name] = self.counts[code]
+        return state
+
+    def report(self, end=False):
+        '''
+        Writes the current progress
+        '''
+        if self.mode == 'silent':
+            return
+        state = self.state()
+        if self.mode == 'json':
+            self.stream.write(json.dumps(state) + '\n')
+        else:
+            eta = '--' if state['eta'] is None else '%.0f s' % state['eta']
+            self.stream.write('\rPhotons %d/%d (%.1f%%)  %.0f rays/s  ETA %s'
+                              '  captured %d  disk %d  escaped %d'
+                              '  incomplete %d'
+                              % (state['done'], state['total'],
+                                 100.*state['fraction'], state['rate'], eta,
+                                 state['captured'], state['disk'],
+                                 state['escaped'], state['incomplete'])
+                              + ('\n' if end else ''))
+        self.stream.flush()
+
+    def finish(self):
+        '''
+        Writes the final report
+        '''
+        self.report(end=True)
+
+    def message(self, text):
+        '''
+        Writes a line of text in the text mode
+        '''
+        if self.mode == 'text':
+            self.stream.write(text + '\n')
+            self.stream.flush()
+
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
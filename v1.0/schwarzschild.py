@@ -12,16 +12,27 @@ ds^2 = -(1-2M/r)dt^2 + dr^2 /(1-2M/r) + r^2 dtheta^2 + r^2 sin^2 (theta) dphi^2
 ===============================================================================
 """
 
-from numpy import sin, cos
+from numpy import sin, cos, asarray, empty_like, moveaxis
 
 class BlackHole:
     '''
     Definition of the Black Hole described by Schwarzschild metric
     '''
+    # The metric is invariant under phi -> -phi, so the image of an 
+    # axisymmetric accretion structure is symmetric about alpha = 0
+    mirror_symmetric = True
+
     def __init__(self, M):
         self.M = M
         self.EH = 2*M
 
+    def unit_mass(self):
+        '''
+        Black hole with M = 1. The geodesics scale with the mass, so they
+        are integrated in units of M with it (see common.to_units_of_M)
+        '''
+        return BlackHole(1.)
+
     def metric(self,x):
         '''
         This procedure contains the Schwarzschild metric non-zero components in 
@@ -32,6 +43,8 @@ class BlackHole:
         r = x[1]
         theta = x[2]
         phi = x[3]
+        x can also be an array with shape (4, N) for N events, and then each 
+        component is returned as an array with shape (N,)
         ===========================================================================
         '''
         # Metric components
@@ -78,6 +91,45 @@ class BlackHole:
         return [dtdlmbda, drdlmbda, dthdlmbda, dphidlmbda, 
                 dk_tdlmbda, dk_rdlmbda, dk_thdlmbda, dk_phidlmbda]
 
+    def geodesics_batch(self, q, lmbda=0., axis=0):
+        '''
+        Batched version of the geodesic equations. It evaluates the
+        right-hand side for N photons in a single NumPy pass.
+        ===========================================================================
+        q : array with shape (8, N) (axis=0) or (N, 8) (axis=1), holding
+            [t, r, theta, phi, k_t, k_r, k_th, k_phi] for each photon
+        axis : axis of q that runs over the 8 components
+        ===========================================================================
+        Returns an array with the same shape as q
+        '''
+        q = asarray(q, dtype=float)
+        if q.shape[axis] != 8:
+            raise ValueError('q must have 8 components along axis %d' % axis)
+        if axis != 0:
+            q = moveaxis(q, axis, 0)
+
+        t, r, th, phi, k_t, k_r, k_th, k_phi = q
+        sin_th = sin(th)
+        r2 = r*r
+        r3 = r2*r
+        f = 1. - 2.*self.M/r
+
+        dqdlmbda = empty_like(q)
+        dqdlmbda[0] = k_t/f
+        dqdlmbda[1] = f*k_r
+        dqdlmbda[2] = k_th/r2
+        dqdlmbda[3] = k_phi/(r*sin_th)**2
+        dqdlmbda[4] = 0.
+        dqdlmbda[5] = -self.M*(k_r/r)**2 + k_th**2/r3 \
+                + k_phi**2/(r3*sin_th**2) \
+                - self.M*(k_t/(r - 2.*self.M))**2
+        dqdlmbda[6] = (cos(th)/sin_th**3)*(k_phi/r)**2
+        dqdlmbda[7] = 0.
+
+        if axis != 0:
+            dqdlmbda = moveaxis(dqdlmbda, 0, axis)
+        return dqdlmbda
+
 
 
 
@@ -0,0 +1,72 @@
+"""
+===============================================================================
+Geometrically thick torus of static gas with gray emission and absorption
+
+The density falls as a Gaussian of the distance to the circle of radius
+R_c in the equatorial plane. The emissivity and the absorption coefficient
+are proportional to the density, and they are integrated along the rays
+by the lockstep integrator (see lockstep_integ).
+===============================================================================
+"""
+
+from numpy import asarray, sin, cos, exp, sqrt, errstate
+
+
+class thick_torus:
+    # The emission does not depend on phi
+    axisymmetric = True
+    # The emission fills a volume instead of the equatorial plane
+    volumetric = True
+
+    def __init__(self, R_c, width, j0=1., kappa0=0.):
+        '''
+        Torus with central radius R_c and Gaussian width, with emissivity
+        j0*density and absorption coefficient kappa0*density (an optically
+        thin torus for kappa0 = 0). The rays are integrated between in_edge
+        and out_edge, 4 widths around R_c.
+        '''
+        self.R_c = R_c
+        self.width = width
+        self.j0 = j0
+        self.kappa0 = kappa0
+        self.in_edge = max(R_c - 4.*width, 0.)
+        self.out_edge = R_c + 4.*width
+
+    def in_units_of_M(self, M):
+        '''
+        The same torus around a black hole of unit mass. The lengths are
+        divided by M and the coefficients multiplied by M, so the optical
+        depth and the intensity do not change.
+        '''
+        return thick_torus(self.R_c/M, self.width/M, self.j0*M,
+                           self.kappa0*M)
+
+    def density(self, r, theta):
+        '''
+        Density of the gas at (r, theta)
+        '''
+        r, theta = asarray(r, dtype=float), asarray(theta, dtype=float)
+        R = r*sin(theta)
+        z = r*cos(theta)
+        return exp(-((R - self.R_c)**2 + z**2)/(2.*self.width**2))
+
+    def coefficients(self, q, blackhole):
+        '''
+        Invariant emissivity j/freq^2 and absorption freq*kappa at the
+        states q (N, 8) of the photons, with freq = -k_t/sqrt(1 - 2M/r) the
+        frequency measured by the static gas
+        '''
+        rho = self.density(q[:, 1], q[:, 2])
+        with errstate(invalid='ignore', divide='ignore'):
+            freq = -q[:, 4]/sqrt(1. - 2.*blackhole.M/q[:, 1])
+        return self.j0*rho/freq**2, self.kappa0*rho*freq
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
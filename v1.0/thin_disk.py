@@ -1,23 +1,66 @@
 """
 ===============================================================================
 Thind accretion disk with a simple linear model of spectrum
+
+For multi-band images, the disk also emits as a black body with the 
+temperature profile T = T_in (r/R_min)^(-3/4) and rotates in Keplerian
+circular orbits.
 ===============================================================================
 @author: Eduard Larrañaga - 2023
 ===============================================================================
 """
 
+from numpy import asarray, where, sqrt, expm1, errstate
+
+
 class thin_disk:
-    def __init__(self, R_min , R_max):
+    # The emission does not depend on phi
+    axisymmetric = True
+
+    def __init__(self, R_min , R_max, T_in=1.):
         self.in_edge = R_min
         self.out_edge = R_max
+        self.m = (1.-0.)/(self.in_edge - self.out_edge)
+        # Temperature at the inner edge, in the units of the frequencies
+        self.T_in = T_in
 
     def spectrum(self, r):
-        m = (1.-0.)/(self.in_edge - self.out_edge)
-        intensity = m * (r - self.out_edge)
-        if r>self.in_edge and r<self.out_edge:
-            return intensity
-        else:
-            return 0.
+        '''
+        Intensity emitted at radius r. r can be an array of hit radii, with
+        NaN for the photons that do not hit the disk.
+        '''
+        r = asarray(r, dtype=float)
+        intensity = self.m * (r - self.out_edge)
+        return where((r>self.in_edge) & (r<self.out_edge), intensity, 0.)
+
+    def intensity(self, r, freq):
+        '''
+        Specific intensity emitted at radius r and frequency freq, measured 
+        in the frame of the disk (black body with h = k_B = c = 1). r and 
+        freq can be arrays that broadcast together.
+        '''
+        r, freq = asarray(r, dtype=float), asarray(freq, dtype=float)
+        T = self.T_in*(r/self.in_edge)**-0.75
+        with errstate(over='ignore', divide='ignore', invalid='ignore'):
+            intensity = freq**3/expm1(freq/T)
+        return where((r>self.in_edge) & (r<self.out_edge), intensity, 0.)
+
+    def redshift(self, fP, blackhole, r_obs):
+        '''
+        Redshift factor g = freq_observed/freq_emitted of the photons with 
+        final states fP (N, 8) at the disk, emitted by gas in prograde 
+        Keplerian circular orbits of the Schwarzschild black hole and 
+        received by a static observer at r_obs. g depends only on r and the 
+        conserved k_t and k_phi of the photon, not on its frequency. It is 
+        NaN inside r = 3M, where there are no circular orbits.
+        '''
+        M = blackhole.M
+        fP = asarray(fP, dtype=float)
+        r = fP[:, 1]
+        Omega = sqrt(M/r**3)
+        with errstate(invalid='ignore', divide='ignore'):
+            return sqrt(1. - 3.*M/r)/(sqrt(1. - 2.*M/r_obs)
+                                      *(1. + Omega*fP[:, 7]/fP[:, 4]))
 
 
 
@@ -0,0 +1,144 @@
+"""
+===============================================================================
+Headless image writers
+
+The image data is written directly to PNG (8-bit), NPY or TIFF (16-bit)
+files, without creating matplotlib figures. matplotlib is only imported
+when a colormap is requested.
+===============================================================================
+"""
+
+import struct
+import zlib
+from numpy import asarray, nan_to_num, clip, uint8, uint16, save, \
+                  ascontiguousarray
+
+
+def normalize(data, vmin=None, vmax=None):
+    '''
+    Scales the data to [0, 1] between vmin and vmax (by default, its
+    minimum and maximum values), with NaN set to 0
+    '''
+    data = nan_to_num(asarray(data, dtype=float))
+    vmin = data.min() if vmin is None else vmin
+    vmax = data.max() if vmax is None else vmax
+    if vmax <= vmin:
+        return 0.*data
+    return clip((data - vmin)/(vmax - vmin), 0., 1.)
+
+
+def colorize(data, cmap=None, bits=8, vmin=None, vmax=None):
+    '''
+    Converts the data into an array of unsigned integers with the given
+    number of bits (8 or 16), with shape (n, m) for cmap=None (grayscale)
+    or (n, m, 3) for the name of a matplotlib colormap
+    '''
+    value = normalize(data, vmin, vmax)
+    if cmap is not None:
+        from matplotlib import colormaps
+        value = colormaps[cmap](value)[..., :3]
+    dtype = uint8 if bits == 8 else uint16
+    return (value*(2**bits - 1) + 0.5).astype(dtype)
+
+
+def screen(image_data):
+    '''
+    Orientation of the image data of the detector on the screen: alpha
+    grows to the right and beta upwards, as in Image.plot
+    '''
+    return asarray(image_data).T[::-1]
+
+
+def write_png(filename, data, cmap='inferno', vmin=None, vmax=None):
+    '''
+    Writes the image data to an 8-bit PNG file
+    '''
+    pixels = colorize(screen(data), cmap, 8, vmin, vmax)
+    height, width = pixels.shape[:2]
+    color_type = 2 if pixels.ndim == 3 else 0
+    rows = pixels.reshape(height, -1)
+    # Each row of the image starts with the filter type 0 (none)
+    raw = b''.join(b'\x00' + row.tobytes() for row in rows)
+
+    def chunk(tag, content):
+        return struct.pack('>I', len(content)) + tag + content \
+                + struct.pack('>I', zlib.crc32(tag + content) & 0xffffffff)
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8,
+                                           color_type, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+def write_tiff(filename, data, cmap=None, vmin=None, vmax=None):
+    '''
+    Writes the image data to an uncompressed 16-bit TIFF file (grayscale
+    for cmap=None)
+    '''
+    pixels = ascontiguousarray(colorize(screen(data), cmap, 16, vmin, vmax))
+    height, width = pixels.shape[:2]
+    samples = 3 if pixels.ndim == 3 else 1
+    image = pixels.astype('<u2').tobytes()
+
+    # Header, image data and then the image file directory
+    offset = 8 + len(image)
+    bits_offset = offset + 2 + 12*10 + 4
+    entries = [(256, 4, 1, width),                  # ImageWidth
+               (257, 4, 1, height),                 # ImageLength
+               (258, 3, samples, 16 if samples == 1 else bits_offset),
+               (259, 3, 1, 1),                      # No compression
+               (262, 3, 1, 2 if samples == 3 else 1),
+               (273, 4, 1, 8),                      # StripOffsets
+               (277, 3, 1, samples),                # SamplesPerPixel
+               (278, 4, 1, height),                 # RowsPerStrip
+               (279, 4, 1, len(image)),             # StripByteCounts
+               (284, 3, 1, 1)]                      # PlanarConfiguration
+    with open(filename, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', offset))
+        f.write(image)
+        f.write(struct.pack('<H', len(entries)))
+        for tag, kind, count, value in entries:
+            packed = struct.pack('<H', value) + b'\x00\x00' if kind == 3 \
+                     and count == 1 else struct.pack('<I', value)
+            f.write(struct.pack('<HHI', tag, kind, count) + packed)
+        f.write(struct.pack('<I', 0))
+        if samples == 3:
+            f.write(struct.pack('<HHH', 16, 16, 16))
+
+
+def write_npy(filename, data):
+    '''
+    Writes the image data (in the orientation of the detector) to a .npy
+    file
+    '''
+    save(filename, asarray(data))
+
+
+def save_image(filename, data, cmap='inferno', vmin=None, vmax=None):
+    '''
+    Writes the image data to a file with the format given by its extension:
+    .png (8-bit, with the colormap cmap), .tif/.tiff (16-bit, grayscale for
+    cmap=None) or .npy (raw data)
+    '''
+    name = filename.lower()
+    if name.endswith('.png'):
+        write_png(filename, data, cmap, vmin, vmax)
+    elif name.endswith('.tif') or name.endswith('.tiff'):
+        write_tiff(filename, data, cmap, vmin, vmax)
+    elif name.endswith('.npy'):
+        write_npy(filename, data)
+    else:
+        raise ValueError('Unknown image format: %s' % filename)
+
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')